@@ -0,0 +1,126 @@
+# Code to run a local stand-in for the ACIS GridData API so Read_Data_2.py can be tested without network access
+
+
+# Editable variables
+
+# CSV used to decide which ANSI codes each state returns (None uses the Areas_of_Interest.csv
+# of the data directory in Settings.py, the same file Read_Data_2.py reads)
+areas_filepath = None
+
+# Port to serve on, the fraction of requests that fail with a server error,
+# and the delay (in seconds) added to every response to imitate the real API
+port = 8765
+failure_rate = 0.0
+response_delay = 0.0
+
+# Number of made-up counties returned for each state on top of the counties of interest
+# (the real API returns every county in the state, not only the ones we keep)
+extra_counties = 20
+
+
+# Import needed packages
+import json
+import random
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+import Settings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+#---------------------------------------------------------------------------
+# Method to return the areas of interest CSV (areas_filepath, or the one in
+# the data directory set in Settings.py)
+#---------------------------------------------------------------------------
+def get_areas_filepath():
+	return Settings.paths['processed']+'Areas_of_Interest.csv' if areas_filepath is None else areas_filepath
+
+
+#---------------------------------------------------------------------------
+# Request handler that answers POST requests with GridData-shaped JSON:
+# {"data": [["YYYY-MM-DD", {"<ANSI code>": value, ...}], ...]}
+#---------------------------------------------------------------------------
+class GridDataHandler(BaseHTTPRequestHandler):
+	def do_POST(self):
+		self.server.request_count += 1
+		params = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+		time.sleep(response_delay)
+
+		if (random.random() < failure_rate):
+			self.send_error(503, 'Injected failure')
+			return
+
+		body = json.dumps(make_grid_data(params, self.server.state_counties)).encode()
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass  # Keep the console quiet, the client prints its own progress
+
+
+#---------------------------------------------------------------------------
+# Method to build a made-up GridData response for the requested state, 
+# element, and dates. Each year's values are seeded by the state, element,
+# and year, so every request returns the same values for the same day (like
+# the real API) whatever range it asks for.
+#---------------------------------------------------------------------------
+def make_grid_data(params, state_counties):
+	state = params['state']
+	element = params['elems'][0]['name']
+	dates = pd.date_range(start=params['sdate'], end=params['edate'])
+	counties = state_counties.get(state, [])
+	fips = counties[0][:2] if len(counties) > 0 else '99'
+	counties = counties + [fips+str(900+i) for i in range(extra_counties)]
+
+	years = []
+	for year in range(dates[0].year, dates[-1].year+1) if len(dates) > 0 else []:
+		year_dates = pd.date_range(str(year)+'-01-01', str(year)+'-12-31')
+		rng = np.random.default_rng([ord(c) for c in state+element]+[year])
+		if (element == 'pcpn'):
+			values = rng.gamma(0.5, 0.3, size=(len(year_dates), len(counties)))
+			values[rng.random(values.shape) < 0.6] = 0.0
+			values = values.round(5)
+		else:
+			values = (60 + 25*np.sin(2*np.pi*(year_dates.dayofyear.to_numpy()[:, None]-110)/365.25)
+					  + rng.normal(0, 6, size=(len(year_dates), len(counties)))).round(2)
+		years.append(values[year_dates.isin(dates)])
+	values = np.concatenate(years) if len(years) > 0 else np.empty((0, len(counties)))
+
+	days = dates.strftime('%Y-%m-%d')
+	return {'data':[[days[i], dict(zip(counties, values[i].tolist()))] for i in range(len(dates))]}
+
+
+#---------------------------------------------------------------------------
+# Method to start the stub server on a background thread and return it
+# (call server.shutdown() to stop it). server.request_count counts the
+# requests received, including the ones that were made to fail.
+#---------------------------------------------------------------------------
+def start_stub_server(port=port):
+	areas_of_interest = pd.read_csv(get_areas_filepath(), dtype={'ANSI Code':str})
+	server = ThreadingHTTPServer(('localhost', port), GridDataHandler)
+	server.state_counties = {state: group['ANSI Code'].str.zfill(5).tolist() 
+							 for state, group in areas_of_interest.groupby('State Initial')}
+	server.request_count = 0
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+
+# Run the server until stopped when this file is run directly
+# (usage: python ACIS_Stub_Server.py [port] [failure_rate])
+if __name__ == '__main__':
+	if (len(sys.argv) > 1):
+		port = int(sys.argv[1])
+	if (len(sys.argv) > 2):
+		failure_rate = float(sys.argv[2])
+	server = start_stub_server(port)
+	print("Stub GridData server running at http://localhost:"+str(port)+"/GridData (press Ctrl+C to stop)")
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		server.shutdown()
@@ -0,0 +1,99 @@
+# Code to build and read the year x state x crop aggregate cube of the final drought data
+
+
+# Editable variables
+# The Processed_Data directory (None uses the one in the data directory set in Settings.py)
+base_filepath = None
+
+# Columns of the final drought data that are aggregated into the cube
+cube_metrics = ['Yield Value', 'Total Drought Time', 'Total Precipitation', 'Total Drought Percentage',
+				'Num_Short', 'Num_Med', 'Num_Long', 'Short_Time', 'Med_Time', 'Long_Time',
+				'GDD', 'KDD', 'Heat_Stress_Days', 'Hot_Dry_Spells']
+
+
+# Importing necessary packages
+import os
+import numpy as np
+import pandas as pd
+import Settings
+import Instrumentation
+import Schema
+
+
+#---------------------------------------------------------------------------
+# Method to return the directory this file reads from and writes to
+# (base_filepath, or the Processed_Data directory set in Settings.py)
+#---------------------------------------------------------------------------
+def get_base_filepath():
+	return Settings.paths['processed'] if base_filepath is None else base_filepath
+
+
+#---------------------------------------------------------------------------
+# Method to build the aggregate cube from the final drought data of each
+# crop (a dictionary of crop name to DataFrame). The cube has one row per
+# crop, state, year, and metric holding the count, sum, sum of squares,
+# minimum, maximum, and mean of that metric, which is enough to combine
+# cells into national or multi-year statistics without the original rows.
+# state_names maps each state initial to its full name.
+#---------------------------------------------------------------------------
+def build_aggregate_cube(crop_data, state_names):
+	parts = []
+	for crop in crop_data:
+		df = crop_data[crop]
+		keys = [df['State'], df['Year']]
+		for metric in cube_metrics:
+			grouped = df[metric].groupby(keys, observed=True)
+			part = pd.DataFrame({'Count':grouped.count(), 'Sum':grouped.sum(),
+								 'Sum Sq':(df[metric]**2).groupby(keys, observed=True).sum(),
+								 'Min':grouped.min(), 'Max':grouped.max()}).reset_index()
+			part.insert(0, 'Crop', crop)
+			part.insert(3, 'Metric', metric)
+			parts.append(part)
+
+	cube = pd.concat(parts, ignore_index=True)
+	cube.insert(2, 'State Name', cube['State'].map(state_names))
+	cube['Mean'] = cube['Sum']/cube['Count'].replace(0, np.nan)
+	return Schema.apply_dtypes(cube, Schema.cube_dtypes)
+
+
+#---------------------------------------------------------------------------
+# Method to combine the cells of the cube over everything not listed in by
+# (for example by=['Crop', 'Year'] gives national values for each year).
+# Returns one row per group and metric with the count, mean, standard
+# deviation, minimum, and maximum, matching the columns of describe().
+#---------------------------------------------------------------------------
+def rollup_cube(cube, by):
+	combined = cube.groupby(by+['Metric'], sort=True, observed=True).agg(Count=('Count', 'sum'), Sum=('Sum', 'sum'),
+														  SumSq=('Sum Sq', 'sum'), Min=('Min', 'min'),
+														  Max=('Max', 'max'))
+	count = combined['Count'].replace(0, np.nan)
+	variance = (combined['SumSq'] - combined['Sum']**2/count)/(count-1)
+	return pd.DataFrame({'count':combined['Count'], 'mean':combined['Sum']/count,
+						 'std':np.sqrt(variance.clip(lower=0)), 'min':combined['Min'],
+						 'max':combined['Max']}).reset_index()
+
+
+#---------------------------------------------------------------------------
+# Method to return the cube saved in Final_Data, building and saving it first
+# if it does not exist yet or if any crop's drought data is newer than it
+#---------------------------------------------------------------------------
+def load_aggregate_cube(crop_list=['Corn', 'Soybean', 'Wheat']):
+	cube_file = os.path.expanduser(get_base_filepath()+'Final_Data/Aggregate_Cube.csv')
+	crop_files = {crop: os.path.expanduser(get_base_filepath()+'Final_Data/'+crop+'_Droughts.csv') for crop in crop_list}
+	for crop in crop_list:
+		Schema.require_columns(crop_files[crop], ['State', 'Year']+cube_metrics)
+	if (os.path.exists(cube_file) and
+			all(os.path.getmtime(crop_files[crop]) <= os.path.getmtime(cube_file) for crop in crop_list)):
+		return pd.read_csv(cube_file, dtype=Schema.cube_dtypes, float_precision='round_trip')
+
+	with Instrumentation.stage('build_cube') as metrics:
+		areas_of_interest = pd.read_csv(get_base_filepath()+'Areas_of_Interest.csv', dtype=Schema.area_dtypes)
+		state_names = areas_of_interest.drop_duplicates('State Initial').set_index('State Initial')['State'].to_dict()
+		crop_data = {crop: pd.read_csv(crop_files[crop], usecols=['State', 'Year']+cube_metrics,
+											 dtype=Schema.drought_dtypes) for crop in crop_list}
+		cube = build_aggregate_cube(crop_data, state_names)
+		cube.to_csv(cube_file, index=False, header=True)
+		metrics['rows'] = sum(len(df) for df in crop_data.values())
+		metrics['bytes_read'] = sum(Instrumentation.file_size(path) for path in crop_files.values())
+		metrics['bytes_written'] = Instrumentation.file_size(cube_file)
+	return cube
@@ -3,108 +3,261 @@
 
 
 # Editable variables
-base_filepath = '~/Processed_Data/'
+# The Processed_Data directory (None uses the one in the data directory set in Settings.py)
+base_filepath = None
+
+# Directory to save every figure to instead of displaying them one window at a time
+# (None displays them as before). Batch rendering works without a display.
+batch_output = None
+
+# File format of the saved figures ('png' or 'svg') and the number of processes drawing them
+figure_format = 'png'
+render_workers = 4
 
 # Importing necessary packages
-import pandas as pd  
+import hashlib
+import json
+import os
+import pandas as pd
+import Settings
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+import Aggregate_Cube
+from Aggregate_Cube import rollup_cube
+import Instrumentation
+import Schema
+import Yield_Regression
+
+
+#---------------------------------------------------------------------------
+# Method to return the directory this file reads from and writes to
+# (base_filepath, or the Processed_Data directory set in Settings.py)
+#---------------------------------------------------------------------------
+def get_base_filepath():
+	return Settings.paths['processed'] if base_filepath is None else base_filepath
+
+
+# ---------------------------
+# 	   Main program code:
+# ---------------------------
+def main():
+	# The cube and the yield regression read their files from the same directory as this file
+	Aggregate_Cube.base_filepath = base_filepath
+	Yield_Regression.base_filepath = base_filepath
 
+	# Import the year x state x crop aggregate cube (built from the final drought data and saved the first time)
+	with Instrumentation.stage('load_cube') as metrics:
+		cube = Aggregate_Cube.load_aggregate_cube()
+		metrics['rows'] = len(cube)
+		metrics['bytes_read'] = Instrumentation.file_size(get_base_filepath()+'Final_Data/Aggregate_Cube.csv')
 
-# Import data sets as DataFrames from CSV files
-areas_of_interest = pd.read_csv(base_filepath+'Areas_of_Interest.csv')
-corn_data = pd.read_csv(base_filepath+'Final_Data/Corn_Droughts.csv')
-soybean_data = pd.read_csv(base_filepath+'Final_Data/Soybean_Droughts.csv')
-wheat_data = pd.read_csv(base_filepath+'Final_Data/Wheat_Droughts.csv')
+	# List containing all of the crop names and their part of the aggregate cube
+	crop_DFs = [[cube[cube['Crop']==crop], crop] for crop in ['Corn', 'Soybean', 'Wheat']]
 
+	# Import the individual droughts (one row per drought) for each crop using compact data types
+	with Instrumentation.stage('load_events') as metrics:
+		for crop in ['Corn', 'Soybean', 'Wheat']:
+			Schema.require_columns(get_base_filepath()+'Final_Data/'+crop+'_Drought_Events.csv', ['Start', 'End'])
+		crop_events = {crop: pd.read_csv(get_base_filepath()+'Final_Data/'+crop+'_Drought_Events.csv',
+										 dtype=Schema.event_dtypes, parse_dates=['Start', 'End'])
+					   for crop in ['Corn', 'Soybean', 'Wheat']}
+		metrics['rows'] = sum(len(events) for events in crop_events.values())
+		metrics['bytes_read'] = sum(Instrumentation.file_size(get_base_filepath()+'Final_Data/'+crop+'_Drought_Events.csv')
+									for crop in crop_events)
 
-# List containing all of the crop files read in and the crop name
-crop_DFs = [[corn_data, 'Corn'], [soybean_data, 'Soybean'], [wheat_data, 'Wheat']]  
+	#--------------------------------------------------------------------
+	# TEMPORARY REASSIGNMENT!!!!
+	#crop_DFs = [[cube[cube['Crop']=='Wheat'], 'Wheat']]
+	#--------------------------------------------------------------------
+	with Instrumentation.stage('statistics', rows=len(cube)):
+		print_statistics(crop_DFs, crop_events)
 
+	# Fit (or read) the detrended yield regression of every county and crop
+	with Instrumentation.stage('yield_regression') as metrics:
+		regression = Yield_Regression.load_yield_regression()
+		metrics['rows'] = len(regression)
+		metrics['bytes_read'] = Instrumentation.file_size(get_base_filepath()+'Final_Data/Yield_Regression.csv')
+	print('\nMedian detrended yield regression of the counties of each crop (bu/A per unit of each predictor):')
+	print(Yield_Regression.summarize_yield_regression(regression).to_string())
 
-# Set up plot settings
-plt.style.use('seaborn')
-plt.rc('font', size=20)          # controls default text sizes
-plt.rc('axes', titlesize=20)     # fontsize of the axes title
-plt.rc('axes', labelsize=20)     # fontsize of the x and y labels
-plt.rc('xtick', labelsize=20)    # fontsize of the tick labels
-plt.rc('ytick', labelsize=20)    # fontsize of the tick labels
-plt.rc('legend', fontsize=20)    # legend fontsize
-plt.rc('figure', titlesize=20, figsize=(15, 8))  # fontsize of the figure title
+	# Either display every figure or save them all to batch_output
+	with Instrumentation.stage('figure_data', rows=len(cube)) as metrics:
+		figures = get_figures(crop_DFs)
+		metrics['figures'] = len(figures)
+	if batch_output is None:
+		set_plot_style()
+		for figure in figures:
+			draw_figure(figure)
+			plt.show()
+	else:
+		with Instrumentation.stage('render_figures', figures=len(figures), workers=render_workers) as metrics:
+			metrics['rows'], metrics['bytes_written'] = render_figures(figures, batch_output, figure_format, render_workers)
 
 
 #--------------------------------------------------------------------
-# TEMPORARY REASSIGNMENT!!!!
-#crop_DFs = [[wheat_data, 'Wheat']]
+# Method to set up the plot settings
 #--------------------------------------------------------------------
-# Create descriptive statistics for each crop DataFrame
-for df in crop_DFs:
-	print('\nDescriptive statistics for all states for the number \nof short, medium, and long droughts ('+df[1]+' seasons):')
-	columns = ['Num_Short', 'Num_Med', 'Num_Long']
-	print(df[0][columns].describe().to_string())
-
-	print('\nDescriptive statistics for all states for the time spent \nin short, medium, and long length droughts ('+df[1]+' seasons):')
-	columns = ['Short_Time', 'Med_Time', 'Long_Time']
-	print(df[0][columns].describe().to_string())
-
-	print('\nDescriptive statistics for the state average of fraction of time spent in drought per '+df[1]+' season by state:')
-	print(df[0].groupby('State')['Total Drought Percentage'].describe().to_string())
-	
-
-
-# Create and display a graph with the entire mean yield and entire mean time in drought
-for df in crop_DFs:
-	by_year = df[0].groupby(['Year'])
-	ax = plt.subplot(3, 1, 1)
-	plt.plot(by_year['Yield Value'].mean(), label='Average Yield', color='green')
-	plt.legend(bbox_to_anchor=(1,1), loc="upper left")
-	plt.ylabel('Yield (bu/A)')
-	plt.title('Average Yield, Average Total Drought Time, & Mean Total Precipitation for '+df[1])
-
-	plt.subplot(3, 1, 2, sharex=ax)
-	plt.plot(by_year['Total Drought Time'].mean(), label='Mean Time in Drought', color='red')
-	#plt.plot(by_year['Total Short Time'].mean(), label='Mean Time in Short Droughts')
-	#plt.plot(by_year['Total Med Time'].mean(), label='Mean Time in Medium Droughts')
-	#plt.plot(by_year['Total Long Time'].mean(), label='Mean in Long Droughts')
-	plt.legend(bbox_to_anchor=(1,1), loc="upper left")
-	plt.ylabel('Days in Drought')
-
-	plt.subplot(3, 1, 3, sharex=ax)
-	plt.plot(by_year['Total Precipitation'].mean(), label='Total Precipitation', color='blue')
-	plt.legend(bbox_to_anchor=(1,1), loc="upper left")
-	plt.ylabel('Precipitation (in.)')
+def set_plot_style():
+	# The seaborn style was renamed in newer versions of Matplotlib
+	if 'seaborn' in plt.style.available:
+		plt.style.use('seaborn')
+	else:
+		plt.style.use('seaborn-v0_8')
+	plt.rc('font', size=20)          # controls default text sizes
+	plt.rc('axes', titlesize=20)     # fontsize of the axes title
+	plt.rc('axes', labelsize=20)     # fontsize of the x and y labels
+	plt.rc('xtick', labelsize=20)    # fontsize of the tick labels
+	plt.rc('ytick', labelsize=20)    # fontsize of the tick labels
+	plt.rc('legend', fontsize=20)    # legend fontsize
+	plt.rc('figure', titlesize=20, figsize=(15, 8))  # fontsize of the figure title
 
-	plt.tight_layout()
-	plt.show()
 
+#--------------------------------------------------------------------
+# Method to create descriptive statistics for each crop from the aggregate cube
+#--------------------------------------------------------------------
+def print_statistics(crop_DFs, crop_events):
+	statistics = ['count', 'mean', 'std', 'min', 'max']
+	for df in crop_DFs:
+		all_states = rollup_cube(df[0], ['Crop']).set_index('Metric')
+
+		print('\nDescriptive statistics for all states for the number \nof short, medium, and long droughts ('+df[1]+' seasons):')
+		columns = ['Num_Short', 'Num_Med', 'Num_Long']
+		print(all_states.loc[columns, statistics].T.to_string())
+
+		print('\nDescriptive statistics for all states for the time spent \nin short, medium, and long length droughts ('+df[1]+' seasons):')
+		columns = ['Short_Time', 'Med_Time', 'Long_Time']
+		print(all_states.loc[columns, statistics].T.to_string())
+
+		print('\nDescriptive statistics for the state average of fraction of time spent in drought per '+df[1]+' season by state:')
+		by_state = rollup_cube(df[0][df[0]['Metric']=='Total Drought Percentage'], ['State'])
+		print(by_state.set_index('State')[statistics].to_string())
 
-# Create and display graphs for each state and each crop comparing average 
-# crop yield and average total drought length
-for df in crop_DFs:
-	crop_DF = df[0].merge(areas_of_interest[['State', 'State Initial']], 
-						  left_on='State', right_on='State Initial')
-	for state in crop_DF['State_y'].unique():
-		cur_state = crop_DF[crop_DF['State_y']==state]
-		by_year = cur_state.groupby(['Year'])
+		events = crop_events[df[1]]
+		print('\nNumber of short, medium, and long droughts starting in each month ('+df[1]+' seasons):')
+		print(pd.crosstab(events['Start'].dt.month, events['Bucket']).to_string())
 
+
+#--------------------------------------------------------------------
+# Method to return the list of figures to draw. Each figure is a
+# dictionary with its file name, crop, state (None for all states), and
+# the yearly means it plots, which is everything needed to draw it.
+#--------------------------------------------------------------------
+def get_figures(crop_DFs):
+	figures = []
+
+	# A graph with the entire mean yield and entire mean time in drought for each crop
+	for df in crop_DFs:
+		by_year = rollup_cube(df[0], ['Year']).pivot(index='Year', columns='Metric', values='mean')
+		figures.append({'name':df[1]+'_All_States', 'crop':df[1], 'state':None, 'by_year':by_year})
+
+	# Graphs for each state and each crop comparing average crop yield and average total drought length
+	for df in crop_DFs:
+		by_state_year = rollup_cube(df[0], ['State Name', 'Year'])
+		for state in by_state_year['State Name'].unique():
+			cur_state = by_state_year[by_state_year['State Name']==state]
+			by_year = cur_state.pivot(index='Year', columns='Metric', values='mean')
+			figures.append({'name':df[1]+'_'+state.replace(' ', '_'), 'crop':df[1], 'state':state, 'by_year':by_year})
+
+	return figures
+
+
+#--------------------------------------------------------------------
+# Method to draw a figure (see get_figures()) on the current figure
+#--------------------------------------------------------------------
+def draw_figure(figure):
+	by_year = figure['by_year']
+	if figure['state'] is None:
+		# Create a graph with the entire mean yield and entire mean time in drought
 		ax = plt.subplot(3, 1, 1)
-		plt.plot(by_year['Yield Value'].mean(), label='Average Yield', color='green')
+		plt.plot(by_year['Yield Value'], label='Average Yield', color='green')
 		plt.legend(bbox_to_anchor=(1,1), loc="upper left")
 		plt.ylabel('Yield (bu/A)')
-		plt.title('Average '+df[1]+' Yield, Mean Total Drought Time, and Mean Total Precipitation in '+state)
+		plt.title('Average Yield, Average Total Drought Time, & Mean Total Precipitation for '+figure['crop'])
 
 		plt.subplot(3, 1, 2, sharex=ax)
-		plt.plot(by_year['Total Drought Time'].mean(), label='Mean Drought Time', color='red')
+		plt.plot(by_year['Total Drought Time'], label='Mean Time in Drought', color='red')
+		#plt.plot(by_year['Short_Time'], label='Mean Time in Short Droughts')
+		#plt.plot(by_year['Med_Time'], label='Mean Time in Medium Droughts')
+		#plt.plot(by_year['Long_Time'], label='Mean in Long Droughts')
 		plt.legend(bbox_to_anchor=(1,1), loc="upper left")
 		plt.ylabel('Days in Drought')
 
 		plt.subplot(3, 1, 3, sharex=ax)
-		plt.plot(by_year['Total Precipitation'].mean(), label='Mean Total Precipitation', color='blue')
+		plt.plot(by_year['Total Precipitation'], label='Total Precipitation', color='blue')
 		plt.legend(bbox_to_anchor=(1,1), loc="upper left")
 		plt.ylabel('Precipitation (in.)')
 
-		plt.tight_layout()
-		plt.show()
+	else:
+		# Create a graph for one state comparing average crop yield and average total drought length
+		ax = plt.subplot(3, 1, 1)
+		plt.plot(by_year['Yield Value'], label='Average Yield', color='green')
+		plt.legend(bbox_to_anchor=(1,1), loc="upper left")
+		plt.ylabel('Yield (bu/A)')
+		plt.title('Average '+figure['crop']+' Yield, Mean Total Drought Time, and Mean Total Precipitation in '+figure['state'])
+
+		plt.subplot(3, 1, 2, sharex=ax)
+		plt.plot(by_year['Total Drought Time'], label='Mean Drought Time', color='red')
+		plt.legend(bbox_to_anchor=(1,1), loc="upper left")
+		plt.ylabel('Days in Drought')
+
+		plt.subplot(3, 1, 3, sharex=ax)
+		plt.plot(by_year['Total Precipitation'], label='Mean Total Precipitation', color='blue')
+		plt.legend(bbox_to_anchor=(1,1), loc="upper left")
+		plt.ylabel('Precipitation (in.)')
+
+	plt.tight_layout()
+
+
+#--------------------------------------------------------------------
+# Method to save every figure to output_dir using a pool of processes.
+# A hash of each figure's data is kept in render_manifest.json so that
+# figures whose data has not changed since they were last saved are skipped.
+# Returns the number of figures that were saved and their size in bytes.
+#--------------------------------------------------------------------
+def render_figures(figures, output_dir, file_format='png', workers=4):
+	output_dir = os.path.expanduser(output_dir)
+	os.makedirs(output_dir, exist_ok=True)
+	manifest_file = os.path.join(output_dir, 'render_manifest.json')
+	manifest = {}
+	if os.path.exists(manifest_file):
+		with open(manifest_file) as file:
+			manifest = json.load(file)
+
+	# Only figures that are missing or whose data changed need to be drawn
+	jobs = []
+	for figure in figures:
+		path = os.path.join(output_dir, figure['name']+'.'+file_format)
+		figure_hash = hashlib.sha1((figure['by_year'].to_csv()+str(figure['state'])+figure['crop']).encode()).hexdigest()
+		if (manifest.get(path) != figure_hash or not os.path.exists(path)):
+			jobs.append((figure, path, figure_hash))
+	print('\nSaving '+str(len(jobs))+' of '+str(len(figures))+' figures to '+output_dir+' (the rest are unchanged)')
+
+	if (len(jobs) > 0):
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			for path, figure_hash in executor.map(save_figure, *zip(*jobs)):
+				manifest[path] = figure_hash
+
+	with open(manifest_file, 'w') as file:
+		json.dump(manifest, file, indent=1)
+	return len(jobs), sum(os.path.getsize(path) for figure, path, figure_hash in jobs)
+
+
+#--------------------------------------------------------------------
+# Method to draw and save one figure with the non-interactive Agg
+# backend (run in the rendering processes)
+#--------------------------------------------------------------------
+def save_figure(figure, path, figure_hash):
+	plt.switch_backend('Agg')
+	set_plot_style()
+	draw_figure(figure)
+	plt.savefig(path)
+	plt.close('all')
+	return path, figure_hash
+
 
 
+# Run the main method (guarded so the rendering processes can import this file)
+if __name__ == '__main__':
+	main()
 
-print('Data has been analyzed and plotted.')
+	print('Data has been analyzed and plotted.')
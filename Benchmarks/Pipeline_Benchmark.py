@@ -0,0 +1,309 @@
+# Code to time every stage of the pipeline on made-up yield and weather data of any size
+
+
+# Editable variables
+
+# Size of the made-up data set (the defaults are a small test, --conus sizes it like
+# every county in the contiguous United States: 48 states of 65 counties each)
+num_states = 4
+counties_per_state = 25
+
+# Number of times each stage is run (the fastest time is reported)
+repeats = 1
+
+# Fraction a stage's rows/sec may fall below (or its peak memory rise above)
+# the baseline before it is reported as a regression
+baseline_tolerance = 0.2
+
+
+# Importing necessary packages
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime as dt
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import Read_Data_1
+import Read_Data_2
+import Process_Data
+import Weather_Store
+import ACIS_Stub_Server
+import Instrumentation
+import Settings
+from Aggregate_Cube import build_aggregate_cube, rollup_cube
+
+# Optional package: only used to report the peak memory of the whole run
+try:
+	import resource
+except ImportError:
+	resource = None
+
+
+# The years every stage works with (Process_Data.py calculates 1991 to 2020 and
+# Read_Data_1.py keeps counties with 30 years of yields, so this is not a setting)
+years = range(1991, 2020+1)
+weather_dates = ['1990-01-01', '2020-12-31']  # Wheat seasons start in November of the year before
+
+# Columns of the raw QuickStats yield files
+raw_yield_columns = ['Program', 'Year', 'Period', 'Week Ending', 'Geo Level', 'State', 'State ANSI',
+					 'Ag District', 'Ag District Code', 'County', 'County ANSI', 'Zip Code', 'Region',
+					 'watershed_code', 'Watershed', 'Commodity', 'Data Item', 'Domain', 'Domain Category',
+					 'Value', 'CV (%)']
+
+# File names (the ones Read_Data_1.py reads) and a typical yield (bu/A) of each crop
+crop_files = Read_Data_1.crop_files
+crop_yields = {'Corn':150.0, 'Soybean':45.0, 'Wheat':55.0}
+default_yield = 100.0  # Used for any other crop added to Read_Data_1.py
+
+
+# ---------------------------
+# 	   Main program code:
+# ---------------------------
+def main():
+	parser = argparse.ArgumentParser(description='Time every stage of the pipeline on made-up data.')
+	parser.add_argument('--states', type=int, default=num_states, help='number of states')
+	parser.add_argument('--counties', type=int, default=counties_per_state, help='counties in each state')
+	parser.add_argument('--conus', action='store_true', help='use 48 states of 65 counties (about every county in the CONUS)')
+	parser.add_argument('--repeats', type=int, default=repeats, help='runs of each stage (the fastest is kept)')
+	parser.add_argument('--output', default='Pipeline_Benchmark_Results.json', help='JSON file to write the results to')
+	parser.add_argument('--baseline', help='earlier results file to compare against')
+	parser.add_argument('--tolerance', type=float, default=baseline_tolerance, help='allowed slowdown before a regression')
+	parser.add_argument('--keep', help='directory to keep the made-up data in (a temporary directory is removed otherwise)')
+	args = parser.parse_args()
+	if args.conus:
+		args.states, args.counties = 48, 65
+
+	work_dir = args.keep if args.keep is not None else tempfile.mkdtemp(prefix='pipeline_benchmark_')
+	try:
+		results = run_benchmarks(work_dir, args.states, args.counties, args.repeats)
+	finally:
+		if args.keep is None:
+			shutil.rmtree(work_dir, ignore_errors=True)
+
+	print_results(results)
+	with open(args.output, 'w') as file:
+		json.dump(results, file, indent=1)
+	print('\nResults written to '+args.output)
+
+	if args.baseline is not None:
+		with open(args.baseline) as file:
+			baseline = json.load(file)
+		regressions = compare_results(results, baseline, args.tolerance)
+		if (len(regressions) > 0):
+			sys.exit(1)
+
+
+#---------------------------------------------------------------------------
+# Method to create the made-up data in work_dir then time each stage of the
+# pipeline on it. Returns a dictionary of the settings, the machine, and the
+# timings of every stage, ready to be written as JSON.
+#---------------------------------------------------------------------------
+def run_benchmarks(work_dir, num_states, counties_per_state, repeats=1):
+	work_dir = os.path.join(os.path.abspath(os.path.expanduser(work_dir)), '')
+	for directory in ['Raw_Data/Yield_Data', 'Processed_Data/Weather_Data', 'Processed_Data/Final_Data']:
+		os.makedirs(work_dir+directory, exist_ok=True)
+
+	print('Creating made-up data for '+str(num_states)+' states of '+str(counties_per_state)+' counties in '+work_dir)
+	num_raw_rows = make_raw_yield_data(work_dir, num_states, counties_per_state)
+	Settings.set_data_directory(work_dir)  # Points every stage at the made-up data
+	Instrumentation.metrics_filepath = work_dir+'Processed_Data/metrics.jsonl'  # Kept with the made-up data
+	stages = []
+
+	# Read_Data_1.py: cleaning the raw yield files
+	stages.append(time_stage('clean_yields', Read_Data_1.main, num_raw_rows, repeats))
+
+	# Read_Data_2.py: decoding the API responses (made by the stub server's generator, without any network).
+	# The responses are saved to files first so only one is in memory at a time, the same as when streaming.
+	areas_of_interest = pd.read_csv(work_dir+'Processed_Data/Areas_of_Interest.csv', dtype={'ANSI Code':str})
+	state_counties = areas_of_interest.groupby('State Initial')['ANSI Code'].apply(list).to_dict()
+	os.makedirs(work_dir+'Responses', exist_ok=True)
+	for state in state_counties:
+		with open(work_dir+'Responses/'+state+'.json', 'w') as file:
+			json.dump(ACIS_Stub_Server.make_grid_data({'state':state, 'sdate':weather_dates[0], 'edate':weather_dates[1],
+													   'elems':[{'name':'pcpn'}]}, state_counties), file)
+	num_days = len(pd.date_range(start=weather_dates[0], end=weather_dates[1]))
+	decoded = {}
+	def decode_weather():
+		for state in state_counties:
+			with open(work_dir+'Responses/'+state+'.json', 'rb') as file:
+				decoded[state] = Read_Data_2.decode_grid_data(FakeResponse(file), state_counties[state], num_days)
+	stages.append(time_stage('decode_weather', decode_weather, num_days*len(areas_of_interest), repeats))
+
+	# Weather_Store.py: packing the weather CSVs into the binary store
+	for state in decoded:
+		dates, counties, values = decoded[state]
+		weather = pd.DataFrame(values, columns=counties)
+		weather.insert(0, 'Date', dates)
+		weather.to_csv(work_dir+'Processed_Data/Weather_Data/'+state+'_AvgPrecip.csv', index=False, header=True)
+	del decoded
+	stages.append(time_stage('weather_store', lambda: Weather_Store.convert_weather_csvs('AvgPrecip'),
+							 num_days*len(areas_of_interest), repeats))
+
+	# Process_Data.py: calculating the droughts of every crop (starting from nothing each time)
+	Process_Data.load_data()
+	crop_data = {}
+	def calculate_droughts():
+		Weather_Store.clear_weather_cache()
+		for crop in crop_files:
+			crop_data[crop] = Process_Data.create_drought_data(crop)[0]
+	num_seasons = (len(Process_Data.corn_counties)+len(Process_Data.soybean_counties))*len(years) \
+				  + len(Process_Data.wheat_counties)*(len(years)-1)  # Process_Data.py skips the first wheat year
+	stages.append(time_stage('drought_calculation', calculate_droughts, num_seasons, repeats))
+
+	# Analyze_Data.py: building the aggregate cube and the roll-ups the statistics and graphs use
+	state_names = areas_of_interest.drop_duplicates('State Initial').set_index('State Initial')['State'].to_dict()
+	def aggregate():
+		cube = build_aggregate_cube(crop_data, state_names)
+		for by in [['Crop'], ['Crop', 'Year'], ['Crop', 'State'], ['Crop', 'State Name', 'Year']]:
+			rollup_cube(cube, by)
+	stages.append(time_stage('aggregate_cube', aggregate, sum(len(df) for df in crop_data.values()), repeats))
+
+	results = {'created':dt.now().isoformat(timespec='seconds'),
+			   'settings':{'states':num_states, 'counties_per_state':counties_per_state,
+						   'counties':len(areas_of_interest), 'years':len(years), 'repeats':repeats},
+			   'machine':{'python':platform.python_version(), 'platform':platform.platform(),
+						  'processor':platform.processor(), 'cpus':os.cpu_count(),
+						  'numpy':np.__version__, 'pandas':pd.__version__},
+			   'stages':stages}
+	if resource is not None:
+		# ru_maxrss is in kilobytes on Linux and bytes on macOS
+		max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		results['peak_rss_mb'] = max_rss/(1024*1024 if sys.platform == 'darwin' else 1024)
+	return results
+
+
+#---------------------------------------------------------------------------
+# Method to time a stage (a function taking no arguments) that processes
+# num_rows rows. The stage is run repeats times and the fastest is kept,
+# then run once more while tracing memory to find its peak allocation
+# (tracing slows Python code down, so it is not timed). Anything the stage
+# prints is hidden.
+#---------------------------------------------------------------------------
+def time_stage(name, stage, num_rows, repeats=1):
+	print('Timing '+name+'...')
+	times = []
+	for i in range(max(repeats, 1)):
+		with contextlib.redirect_stdout(io.StringIO()):
+			start = time.perf_counter()
+			stage()
+			times.append(time.perf_counter()-start)
+
+	tracemalloc.start()
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			stage()
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+	seconds = min(times)
+	return {'stage':name, 'seconds':seconds, 'rows':num_rows,
+			'rows_per_sec':num_rows/seconds if seconds > 0 else float('nan'), 'peak_mb':peak/(1024*1024)}
+
+
+#---------------------------------------------------------------------------
+# Method to write made-up raw QuickStats yield files for every crop into
+# work_dir/Raw_Data/Yield_Data, along with the State.csv file, and return
+# the total number of rows written. Every county has a full 30 years of
+# yields except every tenth one, and each state also has an 'OTHER
+# COUNTIES' row every year, so the cleaning filters have work to do.
+#---------------------------------------------------------------------------
+def make_raw_yield_data(work_dir, num_states, counties_per_state, seed=0):
+	rng = np.random.default_rng(seed)
+	repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+	state_df = pd.read_csv(os.path.join(repo_dir, 'Raw_Data', 'State.csv'), sep='|', dtype=str)
+	state_df = state_df[~state_df['STUSAB'].isin(['AK', 'HI']) & (state_df['STATE'].astype(int) <= 56)]
+	if (num_states > len(state_df)):
+		raise Exception("At most "+str(len(state_df))+" states can be made up.")
+	state_df.to_csv(work_dir+'Raw_Data/State.csv', sep='|', index=False)
+	state_df = state_df.iloc[:num_states]
+
+	num_rows = 0
+	for crop in crop_files:
+		rows = []
+		for state_fips, state_name in zip(state_df['STATE'], state_df['STATE_NAME']):
+			for year in years:
+				for i in range(counties_per_state):
+					if (i % 10 == 9 and year < 1996):
+						continue  # Incomplete county that is removed
+					value = round(crop_yields.get(crop, default_yield)*rng.normal(1.0, 0.15), 1)
+					rows.append([year, state_name.upper(), state_fips, 'DISTRICT '+str(i % 9 + 1), 'COUNTY '+str(i+1),
+								 str(2*i+1).zfill(3), value])
+				rows.append([year, state_name.upper(), state_fips, '', 'OTHER COUNTIES', '', crop_yields.get(crop, default_yield)])
+		raw = pd.DataFrame(rows, columns=['Year', 'State', 'State ANSI', 'Ag District', 'County', 'County ANSI', 'Value'])
+		for column in raw_yield_columns:
+			if column not in raw:
+				raw[column] = ''
+		raw['Program'], raw['Period'], raw['Geo Level'], raw['Commodity'] = 'SURVEY', 'YEAR', 'COUNTY', crop.upper()
+		raw = raw[raw_yield_columns]
+
+		# Crops split over several files (like corn) get an equal share of the rows in each
+		for part, file_name in zip(np.array_split(np.arange(len(raw)), len(crop_files[crop])), crop_files[crop]):
+			raw.iloc[part].to_csv(work_dir+'Raw_Data/Yield_Data/'+file_name, index=False)
+		num_rows += len(raw)
+	return num_rows
+
+
+#---------------------------------------------------------------------------
+# Stand-in for a streamed requests response reading its body from an open
+# file, with the two ways decode_grid_data() reads one (.raw and .json())
+#---------------------------------------------------------------------------
+class FakeResponse:
+	def __init__(self, file):
+		self.raw = file
+
+	def json(self):
+		return json.load(self.raw)
+
+
+#---------------------------------------------------------------------------
+# Method to print a table of the timings of every stage
+#---------------------------------------------------------------------------
+def print_results(results):
+	print('\nStage                   Rows     Seconds        Rows/sec   Peak MB')
+	for stage in results['stages']:
+		print(f"{stage['stage']:20s} {stage['rows']:8d} {stage['seconds']:11.3f} {stage['rows_per_sec']:15.0f} {stage['peak_mb']:9.1f}")
+	if 'peak_rss_mb' in results:
+		print(f"Peak memory of the whole run: {results['peak_rss_mb']:.1f} MB")
+
+
+#---------------------------------------------------------------------------
+# Method to compare results against a baseline from an earlier run. Prints
+# each stage's change and returns the names of the stages whose rows/sec
+# dropped, or whose peak memory grew, by more than the tolerance.
+#---------------------------------------------------------------------------
+def compare_results(results, baseline, tolerance=baseline_tolerance):
+	if (results['settings'] != baseline['settings']):
+		print('\nWarning: the baseline was run with different settings: '+json.dumps(baseline['settings']))
+
+	baseline_stages = {stage['stage']:stage for stage in baseline['stages']}
+	regressions = []
+	print('\nStage                 Speed vs baseline   Memory vs baseline')
+	for stage in results['stages']:
+		if stage['stage'] not in baseline_stages:
+			print(f"{stage['stage']:20s}   (not in baseline)")
+			continue
+		speed = stage['rows_per_sec']/baseline_stages[stage['stage']]['rows_per_sec']
+		memory = stage['peak_mb']/max(baseline_stages[stage['stage']]['peak_mb'], 1e-9)
+		regressed = speed < 1-tolerance or memory > 1+tolerance
+		if regressed:
+			regressions.append(stage['stage'])
+		print(f"{stage['stage']:20s} {speed:17.2f}x {memory:19.2f}x" + ('   REGRESSION' if regressed else ''))
+
+	print('\n'+str(len(regressions))+' regressions found (tolerance '+str(tolerance)+')')
+	return regressions
+
+
+# Run the benchmarks
+if __name__ == '__main__':
+	main()
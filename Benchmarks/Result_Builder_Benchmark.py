@@ -0,0 +1,64 @@
+# Code to time building the drought DataFrame as the number of counties grows
+
+
+# Editable variables
+
+# Numbers of counties to time (each with 30 seasons of made-up precipitation)
+county_counts = [50, 100, 200, 400, 800]
+
+# Largest number of counties to also time with the old one-row-at-a-time approach (it is quadratic)
+max_row_append_counties = 200
+
+
+# Importing necessary packages
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Drought_Engine import calculate_season_droughts
+
+
+#---------------------------------------------------------------------------
+# Method to create the drought data rows for the given number of counties
+# and 30 growing seasons of random precipitation
+#---------------------------------------------------------------------------
+def make_records(num_counties, rng):
+	counties = [str(i).zfill(5) for i in range(num_counties)]
+	records = []
+	for year in range(1991, 2020+1):
+		growth_season = pd.date_range(start=str(year)+'-04-01', end=str(year)+'-10-31')
+		precip = rng.gamma(0.5, 0.3, size=(len(growth_season), num_counties))
+		precip[rng.random(precip.shape) < 0.6] = 0.0
+		season, events = calculate_season_droughts(precip, growth_season)
+		for i, county in enumerate(counties):
+			data = {'Year':year, 'County':county, 'State':'XX', 'Location':county}
+			for column in season:
+				data[column] = season[column][i]
+			records.append(data)
+	return records
+
+
+# Time both ways of building the DataFrame for each number of counties
+if __name__ == '__main__':
+	rng = np.random.default_rng(0)
+	print('Counties    Rows   Build list (s)   Per row (us)   Row appends (s)')
+	for num_counties in county_counts:
+		records = make_records(num_counties, rng)
+
+		start = time.perf_counter()
+		droughts = pd.DataFrame.from_records(records)
+		build_time = time.perf_counter()-start
+
+		# The old approach copied the whole DataFrame every time a row was added
+		append_time = float('nan')
+		if (num_counties <= max_row_append_counties):
+			start = time.perf_counter()
+			appended = pd.DataFrame(columns=list(records[0]))
+			for data in records:
+				appended = pd.concat([appended, pd.DataFrame([data])], ignore_index=True)
+			append_time = time.perf_counter()-start
+
+		print(f'{num_counties:8d} {len(records):7d} {build_time:16.4f} {1e6*build_time/len(records):14.2f} {append_time:17.2f}')
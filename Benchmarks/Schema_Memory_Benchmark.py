@@ -0,0 +1,73 @@
+# Code to compare the memory each data file takes when read with pandas' default types and with Schema.py's types
+
+
+# The data directory of Settings.py is used, or another passed as the only argument
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import Settings
+
+# Editable variables
+
+# Files to compare (relative to Processed_Data) and the types Schema.py reads each with
+data_files = {'Areas_of_Interest.csv':'area_dtypes',
+			  'Cleaned_Corn_Yield.csv':'yield_dtypes',
+			  'Cleaned_Soybean_Yield.csv':'yield_dtypes',
+			  'Cleaned_Wheat_Yield.csv':'yield_dtypes',
+			  'Final_Data/Corn_Droughts.csv':'drought_dtypes',
+			  'Final_Data/Soybean_Droughts.csv':'drought_dtypes',
+			  'Final_Data/Wheat_Droughts.csv':'drought_dtypes',
+			  'Final_Data/Corn_Drought_Events.csv':'event_dtypes',
+			  'Final_Data/Soybean_Drought_Events.csv':'event_dtypes',
+			  'Final_Data/Wheat_Drought_Events.csv':'event_dtypes',
+			  'Final_Data/Aggregate_Cube.csv':'cube_dtypes'}
+
+
+# Importing necessary packages
+import glob
+import pandas as pd
+import Schema
+import Weather_Store
+
+
+#---------------------------------------------------------------------------
+# Method to return the memory (in megabytes) a DataFrame takes, including
+# the strings it holds
+#---------------------------------------------------------------------------
+def memory_mb(df):
+	return df.memory_usage(deep=True).sum()/(1024*1024)
+
+
+#---------------------------------------------------------------------------
+# Method to print one row of the comparison
+#---------------------------------------------------------------------------
+def print_row(name, before, after):
+	print(f'{name:<40} {before:>12.2f} {after:>12.2f} {before/after if after > 0 else float("nan"):>8.1f}x')
+
+
+# Read every data file that exists both ways and print the memory each takes
+if __name__ == '__main__':
+	if (len(sys.argv) > 1):
+		Settings.set_data_directory(sys.argv[1])
+	base_filepath = os.path.expanduser(Settings.paths['processed'])
+
+	print(f'{"File":<40} {"Default (MB)":>12} {"Schema (MB)":>12} {"Saving":>9}')
+	total_before, total_after = 0, 0
+	for name in data_files:
+		path = base_filepath+name
+		if not os.path.exists(path):
+			continue
+		before = memory_mb(pd.read_csv(path))
+		after = memory_mb(pd.read_csv(path, dtype=getattr(Schema, data_files[name])))
+		print_row(name, before, after)
+		total_before, total_after = total_before+before, total_after+after
+
+	# Weather files: pandas' default types with string column names, against load_weather()
+	for path in sorted(glob.glob(base_filepath+'Weather_Data/*_*.csv')):
+		state, element = os.path.basename(path)[:-4].split('_', 1)
+		before = memory_mb(pd.read_csv(path, index_col='Date', parse_dates=['Date']))
+		after = memory_mb(Weather_Store.load_weather(state, element))
+		print_row('Weather_Data/'+os.path.basename(path), before, after)
+		total_before, total_after = total_before+before, total_after+after
+
+	print_row('Total', total_before, total_after)
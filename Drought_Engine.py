@@ -0,0 +1,89 @@
+# Code to calculate drought data for every county in a state at once from a (days x counties) precipitation array
+
+
+# Importing necessary packages
+import numpy as np
+
+
+# Precipitation (in.) at or below which a day is counted as dry
+dry_threshold = 0.00005
+
+# Minimum lengths (in days) of short, medium, and long droughts (5-8, 9-14, & 15+ days respectively)
+short_min, med_min, long_min = 5, 9, 15
+
+# Names of the drought buckets, in the order of the bucket numbers used below
+bucket_names = ['Short', 'Med', 'Long']
+
+
+#---------------------------------------------------------------------------
+# Method to find every run of True values in a (days x counties) array of
+# flags at once. Returns the county column, starting row, and length of
+# each run, ordered by county and then by start date. Runs still going at
+# the end of the array are counted.
+#---------------------------------------------------------------------------
+def find_runs(flags):
+	num_days, num_counties = flags.shape
+
+	# Pad each county with a False day on both ends so every run has a start and an end edge
+	padded = np.zeros((num_days+2, num_counties), dtype=np.int8)
+	padded[1:-1] = flags
+	edges = np.diff(padded, axis=0).T  # Transposed so that np.nonzero() returns runs county by county
+	county, start = np.nonzero(edges == 1)
+	end = np.nonzero(edges == -1)[1]
+	return county, start, end - start
+
+
+#---------------------------------------------------------------------------
+# Method to find every dry run in a season at once. Returns the county column,
+# starting row, and length of each run that counts as a drought (at least
+# short_min days long and ended by a day of rain), ordered by county and then
+# by start date. Runs that are still going at the end of the season or that
+# are broken by missing data are not counted, the same as the per-day loop.
+#---------------------------------------------------------------------------
+def find_dry_runs(precip):
+	num_days = precip.shape[0]
+	wet = precip > dry_threshold  # Both comparisons are False for missing (NaN) days
+	county, start, length = find_runs(precip <= dry_threshold)
+	end = start + length  # The first non-dry row after each run
+
+	# Only keep runs that are long enough and that were ended by rain
+	ended = end < num_days
+	ended[ended] = wet[end[ended], county[ended]]
+	keep = ended & (length >= short_min)
+	return county[keep], start[keep], length[keep]
+
+
+#---------------------------------------------------------------------------
+# Method to calculate the drought data for all counties in a single growing
+# season. precip holds one row per day of growth_season and one column per
+# county. Returns a dictionary of drought columns, each holding one value per
+# county in the same order as the columns of precip, and a dictionary of 
+# drought events with one entry per drought (the county column, start date,
+# end date, length, and bucket of each one). The end date is the first day
+# of rain after the drought.
+#---------------------------------------------------------------------------
+def calculate_season_droughts(precip, growth_season):
+	precip = np.asarray(precip, dtype=np.float64)  # Stored as 32-bit floats, added up in 64-bit floats
+	num_days, num_counties = precip.shape
+	county, start, length = find_dry_runs(precip)
+	bucket = np.digitize(length, [med_min, long_min])  # 0 = short, 1 = medium, 2 = long
+
+	# Count the number of droughts and the days spent in them for each bucket and county
+	index = bucket*num_counties + county
+	counts = np.bincount(index, minlength=3*num_counties).reshape(3, num_counties)
+	times = np.bincount(index, weights=length, minlength=3*num_counties).reshape(3, num_counties).astype(int)
+	total_drought = times.sum(axis=0)
+
+	# Running sum down each column so the totals are added day by day like the per-day loop
+	total_pcpn = np.cumsum(precip, axis=0, dtype=np.float64)[-1]
+
+	data = {'Num_Short':counts[0].tolist(), 'Num_Med':counts[1].tolist(), 'Num_Long':counts[2].tolist(),
+			'Total Precipitation':total_pcpn.tolist(),
+			'Short_Time':times[0].tolist(), 'Med_Time':times[1].tolist(), 'Long_Time':times[2].tolist(),
+			'Total Drought Time':total_drought.tolist(),
+			'Total Drought Percentage':(total_drought/num_days).tolist()
+			}
+
+	days = np.asarray(growth_season, dtype='datetime64[D]')
+	events = {'county':county, 'start':days[start], 'end':days[start+length], 'length':length, 'bucket':bucket}
+	return data, events
@@ -0,0 +1,59 @@
+# Code to calculate growing degree days and heat stress for every county in a state at once from (days x counties) temperature arrays
+
+
+# Importing necessary packages
+import numpy as np
+from Drought_Engine import dry_threshold, find_runs
+
+
+# Temperatures (degrees F) used for each crop: the base and cap of its growing degree days and the
+# daily high above which it is heat stressed (killing degree days are counted above the same threshold)
+crop_temperatures = {'Corn':{'gdd_base':50, 'gdd_cap':86, 'heat_threshold':86},
+					 'Soybean':{'gdd_base':50, 'gdd_cap':86, 'heat_threshold':90},
+					 'Wheat':{'gdd_base':32, 'gdd_cap':86, 'heat_threshold':90}}
+
+# Minimum length (in days) of a hot-dry spell: consecutive days that are both heat stressed and dry
+hot_dry_min = 3
+
+# Columns returned by calculate_season_heat()
+heat_columns = ['GDD', 'KDD', 'Heat_Stress_Days', 'Hot_Dry_Spells', 'Longest_Hot_Dry_Spell']
+
+
+#---------------------------------------------------------------------------
+# Method to calculate the heat data for all counties in a single growing
+# season. maxt, mint, and precip hold one row per day of the season and one
+# column per county, and temperatures holds a crop's settings from
+# crop_temperatures. Returns a dictionary of heat columns, each holding one
+# value per county in the same order as the columns of the arrays:
+#   GDD: growing degree days, from the daily high and low each held between
+#        the base and cap temperatures
+#   KDD: killing degree days, the degrees of each daily high above the heat
+#        stress threshold
+#   Heat_Stress_Days: days with a high above the heat stress threshold
+#   Hot_Dry_Spells / Longest_Hot_Dry_Spell: number of runs of at least
+#        hot_dry_min heat stressed and dry days, and the longest run
+# A missing (NaN) temperature gives a NaN total and breaks any spell, the
+# same as missing precipitation does for droughts.
+#---------------------------------------------------------------------------
+def calculate_season_heat(maxt, mint, precip, temperatures):
+	maxt = np.asarray(maxt, dtype=np.float64)
+	mint = np.asarray(mint, dtype=np.float64)
+	precip = np.asarray(precip, dtype=np.float64)
+	num_counties = maxt.shape[1]
+	base, cap, threshold = temperatures['gdd_base'], temperatures['gdd_cap'], temperatures['heat_threshold']
+
+	# Degree days of every day and county at once (np.clip keeps NaN days as NaN)
+	gdd = (np.clip(maxt, base, cap) + np.clip(mint, base, cap))/2 - base
+	kdd = np.maximum(maxt - threshold, 0)
+
+	# Hot-dry spells are runs of days that are both heat stressed and dry
+	hot = maxt > threshold  # False for missing (NaN) days
+	county, start, length = find_runs(hot & (precip <= dry_threshold))
+	keep = length >= hot_dry_min
+	spells = np.bincount(county[keep], minlength=num_counties)
+	longest = np.zeros(num_counties, dtype=int)
+	np.maximum.at(longest, county[keep], length[keep])
+
+	return {'GDD':gdd.sum(axis=0, dtype=np.float64).tolist(), 'KDD':kdd.sum(axis=0, dtype=np.float64).tolist(),
+			'Heat_Stress_Days':hot.sum(axis=0).tolist(),
+			'Hot_Dry_Spells':spells.tolist(), 'Longest_Hot_Dry_Spell':longest.tolist()}
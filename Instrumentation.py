@@ -0,0 +1,168 @@
+# Code to record how long each stage of the toolset takes and how much it processes as JSON lines
+
+
+# Editable variables
+
+# Whether measurements are recorded, and the file every one is added to as one JSON object per line
+# (None uses metrics.jsonl in the Processed_Data directory of the data directory set in Settings.py)
+record_metrics = True
+metrics_filepath = None
+
+# Optional profiler run around the drought calculations of each state: None, 'cprofile'
+# (a .prof file per state next to the metrics file, readable with pstats or snakeviz)
+# or 'tracemalloc' (the lines allocating the most memory are added to the metrics)
+profile_mode = None
+
+# Number of functions or lines kept in the metrics from each profile
+profile_top = 15
+
+
+# Importing necessary packages
+import cProfile
+import io
+import json
+import os
+import pstats
+import socket
+import time
+import tracemalloc
+import warnings
+from contextlib import contextmanager
+import Settings
+import Weather_Store
+
+# Optional package: peak memory is only recorded where it is available (not on Windows)
+try:
+	import resource
+except ImportError:
+	resource = None
+
+
+#---------------------------------------------------------------------------
+# Method to add one measurement to the metrics file. Every line holds the
+# time, host, process id, and peak memory of the process along with the
+# given fields. Lines are written with a single call to an appending file,
+# so worker processes can share the file. A line that cannot be written
+# only gives a warning, so recording never stops the stage being measured.
+#---------------------------------------------------------------------------
+def record(event, **fields):
+	if not record_metrics:
+		return
+	line = {'time':time.time(), 'event':event, 'host':socket.gethostname(), 'pid':os.getpid()}
+	line.update(fields)
+	line['peak_rss_mb'] = peak_rss_mb()
+	path = os.path.expanduser(get_metrics_filepath())
+	try:
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+		with open(path, 'a') as file:
+			file.write(json.dumps(line, default=str)+'\n')
+	except OSError as e:
+		warnings.warn("Could not record '"+event+"' metrics in "+path+": "+str(e))
+
+
+#---------------------------------------------------------------------------
+# Method to return the metrics file (metrics_filepath, or metrics.jsonl in
+# the Processed_Data directory set in Settings.py)
+#---------------------------------------------------------------------------
+def get_metrics_filepath():
+	return Settings.paths['processed']+'metrics.jsonl' if metrics_filepath is None else metrics_filepath
+
+
+#---------------------------------------------------------------------------
+# Method to return the most memory (in megabytes) the process has used so
+# far, or None where it cannot be found
+#---------------------------------------------------------------------------
+def peak_rss_mb():
+	if resource is None:
+		return None
+	# ru_maxrss is in kilobytes on Linux and bytes on macOS
+	max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return max_rss/(1024*1024 if os.uname().sysname == 'Darwin' else 1024)
+
+
+#---------------------------------------------------------------------------
+# Method to return the size of a file in bytes (0 if it does not exist)
+#---------------------------------------------------------------------------
+def file_size(path):
+	path = os.path.expanduser(path)
+	return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+#---------------------------------------------------------------------------
+# Context manager to measure a stage (or a single unit of one, like a state
+# or county) and record it when it finishes, even if it fails. The code
+# being measured fills in the counts it knows about through the dictionary
+# it is given, for example:
+#
+#     with stage('clean_yields', crop='Corn') as metrics:
+#         ...
+#         metrics['rows'] = len(yield_df)
+#
+# The wall time, the weather cache hits and misses during the stage, and
+# the error (if one was raised) are added automatically. rows_per_sec is
+# added when rows is given.
+#---------------------------------------------------------------------------
+@contextmanager
+def stage(name, **fields):
+	metrics = {'rows':None, 'bytes_read':0, 'bytes_written':0}
+	metrics.update(fields)
+	hits, misses = Weather_Store.cache_stats['hits'], Weather_Store.cache_stats['misses']
+	start = time.perf_counter()
+	try:
+		yield metrics
+	except BaseException as e:
+		metrics['error'] = repr(e)
+		raise
+	finally:
+		metrics['seconds'] = time.perf_counter()-start
+		metrics['cache_hits'] = Weather_Store.cache_stats['hits']-hits
+		metrics['cache_misses'] = Weather_Store.cache_stats['misses']-misses
+		if (metrics['rows'] is not None and metrics['seconds'] > 0):
+			metrics['rows_per_sec'] = metrics['rows']/metrics['seconds']
+		record(name, **metrics)
+
+
+#---------------------------------------------------------------------------
+# Context manager to run the profiler chosen by profile_mode around a block
+# of code (it does nothing when profile_mode is None). The results are
+# recorded as a 'profile' line named after name.
+#---------------------------------------------------------------------------
+@contextmanager
+def profile(name):
+	if (profile_mode is None or not record_metrics):
+		yield
+		return
+
+	if (profile_mode == 'cprofile'):
+		profiler = cProfile.Profile()
+		profiler.enable()
+		try:
+			yield
+		finally:
+			profiler.disable()
+			profile_file = os.path.join(os.path.dirname(os.path.expanduser(get_metrics_filepath())), name+'.prof')
+			try:
+				profiler.dump_stats(profile_file)
+			except OSError as e:
+				warnings.warn("Could not write the profile "+profile_file+": "+str(e))
+			output = io.StringIO()
+			pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(profile_top)
+			record('profile', name=name, mode=profile_mode, file=profile_file, top=output.getvalue())
+
+	elif (profile_mode == 'tracemalloc'):
+		already_tracing = tracemalloc.is_tracing()
+		if not already_tracing:
+			tracemalloc.start()
+		tracemalloc.reset_peak()
+		try:
+			yield
+		finally:
+			snapshot = tracemalloc.take_snapshot()
+			peak = tracemalloc.get_traced_memory()[1]
+			if not already_tracing:
+				tracemalloc.stop()
+			top = [str(statistic) for statistic in snapshot.statistics('lineno')[:profile_top]]
+			record('profile', name=name, mode=profile_mode, traced_peak_mb=peak/(1024*1024), top=top)
+
+	else:
+		raise Exception("Unknown profile_mode '"+str(profile_mode)+"'. Please use None, 'cprofile', or 'tracemalloc'.")
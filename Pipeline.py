@@ -0,0 +1,126 @@
+# Command line interface to run each step of the toolset from one place
+#
+# Usage: python Pipeline.py [--data-dir DIR] {clean,fetch,process,analyze,serve} [options]
+#   clean    Clean the raw crop yield data (Read_Data_1.py)
+#   fetch    Download the weather data (Read_Data_2.py)
+#   process  Calculate the drought data (Process_Data.py)
+#   analyze  Print statistics and graph the results (Analyze_Data.py)
+#   serve    Answer drought and yield queries over HTTP (Query_Service.py)
+# Run 'python Pipeline.py <step> --help' to see the options of a step.
+
+
+# Importing necessary packages
+import argparse
+import Settings
+
+
+#---------------------------------------------------------------------------
+# Methods to run each step. The files of each step are only imported once
+# that step is chosen, so no step loads anything it does not need.
+#---------------------------------------------------------------------------
+def run_clean(args):
+	import Read_Data_1
+	Read_Data_1.main()
+	print("\nData reading & processing is now fully completed!\n")
+
+def run_fetch(args):
+	import Read_Data_2
+	if args.elements is not None:
+		Read_Data_2.elems_of_interest = args.elements
+	if args.api_url is not None:
+		Read_Data_2.api_url = args.api_url
+	if args.max_concurrent_calls is not None:
+		Read_Data_2.max_concurrent_calls = args.max_concurrent_calls
+	Read_Data_2.main()
+	print('Weather data has been successfully downloaded and cleaned.')
+
+def run_process(args):
+	import Process_Data
+	import Instrumentation
+	if args.workers is not None:
+		Process_Data.num_workers = args.workers
+	if args.full:
+		Process_Data.incremental = False
+	if args.profile is not None:
+		Instrumentation.profile_mode = args.profile
+	Process_Data.main()
+	print('Data has been processed and drought data has been calculated.')
+
+def run_analyze(args):
+	import Analyze_Data
+	if args.output is not None:
+		Analyze_Data.batch_output = args.output
+	if args.format is not None:
+		Analyze_Data.figure_format = args.format
+	if args.render_workers is not None:
+		Analyze_Data.render_workers = args.render_workers
+	Analyze_Data.main()
+	print('Data has been analyzed and plotted.')
+
+def run_serve(args):
+	import time
+	import Query_Service
+	if args.cache_size is not None:
+		Query_Service.max_cached_results = args.cache_size
+	server = Query_Service.start_query_server(args.port)
+	print("Query service running at http://localhost:"+str(args.port)+"/ (press Ctrl+C to stop)")
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		server.shutdown()
+
+
+#---------------------------------------------------------------------------
+# Method to return the parser of the command line arguments
+#---------------------------------------------------------------------------
+def get_parser():
+	parser = argparse.ArgumentParser(description='Crop yield and drought analysis toolset.')
+	parser.add_argument('--data-dir', help='directory holding Raw_Data and Processed_Data (default: '
+											+Settings.data_directory+')')
+	parser.add_argument('--no-metrics', action='store_true', help='do not record metrics in Processed_Data/metrics.jsonl')
+	steps = parser.add_subparsers(dest='step', required=True)
+
+	clean = steps.add_parser('clean', help='clean the raw crop yield data')
+	clean.set_defaults(run=run_clean)
+
+	fetch = steps.add_parser('fetch', help='download the weather data')
+	fetch.add_argument('--elements', nargs='+', choices=['maxt', 'mint', 'avgt', 'pcpn'], help='weather elements to download')
+	fetch.add_argument('--api-url', help='GridData endpoint (for example the address of ACIS_Stub_Server.py)')
+	fetch.add_argument('--max-concurrent-calls', type=int, help='number of API calls made at the same time')
+	fetch.set_defaults(run=run_fetch)
+
+	process = steps.add_parser('process', help='calculate the drought data')
+	process.add_argument('--workers', type=int, help='number of worker processes')
+	process.add_argument('--full', action='store_true', help='recalculate everything instead of only what changed')
+	process.add_argument('--profile', choices=['cprofile', 'tracemalloc'], help='profile the drought calculations')
+	process.set_defaults(run=run_process)
+
+	analyze = steps.add_parser('analyze', help='print statistics and graph the results')
+	analyze.add_argument('--output', help='directory to save the graphs to instead of displaying them')
+	analyze.add_argument('--format', choices=['png', 'svg'], help='file format of the saved graphs')
+	analyze.add_argument('--render-workers', type=int, help='number of processes saving the graphs')
+	analyze.set_defaults(run=run_analyze)
+
+	serve = steps.add_parser('serve', help='answer drought and yield queries over HTTP')
+	serve.add_argument('--port', type=int, default=8766, help='port to listen on (default: 8766)')
+	serve.add_argument('--cache-size', type=int, help='number of summary results kept in memory')
+	serve.set_defaults(run=run_serve)
+	return parser
+
+
+# ---------------------------
+# 	   Main program code:
+# ---------------------------
+def main(argv=None):
+	args = get_parser().parse_args(argv)
+	if args.data_dir is not None:
+		Settings.set_data_directory(args.data_dir)
+	if args.no_metrics:
+		import Instrumentation
+		Instrumentation.record_metrics = False
+	args.run(args)
+
+
+if __name__ == '__main__':
+	main()
@@ -3,32 +3,62 @@
 
 
 # Editable variables
-base_filepath = '~/Processed_Data/'
-
-# Importing necessary packages
-import pandas as pd 
+# The Processed_Data directory (None uses the one in the data directory set in Settings.py)
+base_filepath = None
 
+# Number of worker processes used for the drought calculations (1 runs everything in this process)
+num_workers = 1
 
-# Import data into pandas DataFrames
-corn_yield = pd.read_csv(base_filepath+'Cleaned_Corn_Yield.csv')
-soybean_yield = pd.read_csv(base_filepath+'Cleaned_Soybean_Yield.csv')
-wheat_yield = pd.read_csv(base_filepath+'Cleaned_Wheat_Yield.csv')
-areas_of_interest = pd.read_csv(base_filepath+'Areas_of_Interest.csv')
+# Whether to only recalculate the county/year combinations whose weather, yield, or settings
+# changed since the last run (tracked in Final_Data/manifest.json) and reuse the rest
+incremental = True
 
-# Turn the ANSI codes for yield DataFrames into the proper string format
-corn_yield['ANSI Code'] = corn_yield['ANSI Code'].astype(str).str.zfill(5)
-soybean_yield['ANSI Code'] = soybean_yield['ANSI Code'].astype(str).str.zfill(5)
-wheat_yield['ANSI Code'] = wheat_yield['ANSI Code'].astype(str).str.zfill(5)
+# Importing necessary packages
+import hashlib
+import json
+import os
+import time
+import traceback
+import numpy as np
+import pandas as pd 
+import Settings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import Drought_Engine
+from Drought_Engine import calculate_season_droughts, bucket_names
+import Heat_Engine
+from Heat_Engine import calculate_season_heat, heat_columns
+import Rolling_Precip
+from Rolling_Precip import calculate_season_anomalies, rolling_columns
+import Weather_Store
+import Weather_Validation
+from Weather_Store import load_weather, cache_stats
+import Instrumentation
+import Schema
+
+
+# Yield data and counties of interest for each crop (read by load_data() the first time they are needed)
+corn_yield, soybean_yield, wheat_yield = None, None, None
+corn_counties, soybean_counties, wheat_counties = None, None, None
+areas_of_interest = None
+
+# Columns of the DataFrames storing drought information for each crop using custom drought durations
+drought_columns = ['Year', 'County', 'State', 'Location',
+				   'Num_Short', 'Num_Med', 'Num_Long',
+				   'Total Precipitation',
+				   'Short_Time', 'Med_Time', 'Long_Time',
+				   'Total Drought Time', 'Total Drought Percentage',
+				   'GDD', 'KDD', 'Heat_Stress_Days', 'Hot_Dry_Spells', 'Longest_Hot_Dry_Spell'] + rolling_columns
+
+# Columns of the DataFrames storing every individual drought (one row per drought) for each crop
+event_columns = ['ANSI Code', 'Crop', 'Year', 'Start', 'End', 'Length', 'Bucket']
 
-# Find the counties of interest for each specific crop
-corn_counties = [str(i).zfill(5) for i in corn_yield['ANSI Code'].unique().tolist()]
-soybean_counties = [str(i).zfill(5) for i in soybean_yield['ANSI Code'].unique().tolist()]
-wheat_counties = [str(i).zfill(5) for i in wheat_yield['ANSI Code'].unique().tolist()]
 
-# Turn all ANSI codes in areas_of_interest into the proper string format
-areas_of_interest['ANSI Code'] = areas_of_interest['ANSI Code'].astype(str).str.zfill(5)
-# Turns the ANSI codes into the indices of areas_of_interest
-areas_of_interest.set_index('ANSI Code', inplace=True)
+#---------------------------------------------------------------------------
+# Method to return the directory this file reads from and writes to
+# (base_filepath, or the Processed_Data directory set in Settings.py)
+#---------------------------------------------------------------------------
+def get_base_filepath():
+	return Settings.paths['processed'] if base_filepath is None else base_filepath
 
 
 # ---------------------------
@@ -36,17 +66,98 @@ areas_of_interest.set_index('ANSI Code', inplace=True)
 # ---------------------------
 def main():
 	# Use the create_drought_data() method to process and create data for each crop
+	# States are split across a pool of worker processes when num_workers is more than 1
+	# Previous results are only reused when incremental is True
 	crop_list = ['Corn', 'Soybean', 'Wheat']
-	for crop in crop_list:
-		crop_complete = create_drought_data(crop)
-		crop_complete.to_csv(r''+base_filepath+'Final_Data/'+crop+'_Droughts.csv', index=False, header=True)
+	load_data()
+	manifest = load_manifest() if incremental else {}
+	pool = (ProcessPoolExecutor(max_workers=num_workers, initializer=set_worker_paths,
+								initargs=(Settings.data_directory, base_filepath, Weather_Store.weather_filepath,
+										  Instrumentation.record_metrics, Instrumentation.metrics_filepath,
+										  Instrumentation.profile_mode, Weather_Validation.missing_policy))
+			if num_workers > 1 else None)
+	try:
+		for crop in crop_list:
+			with Instrumentation.stage('process_crop', crop=crop, workers=num_workers) as metrics:
+				previous = load_previous_results(crop, manifest) if incremental else None
+				crop_complete, crop_events, manifest[crop] = create_drought_data(crop, pool=pool, previous=previous)
+				Schema.to_csv(crop_complete, r''+get_base_filepath()+'Final_Data/'+crop+'_Droughts.csv')
+				Schema.to_csv(crop_events, r''+get_base_filepath()+'Final_Data/'+crop+'_Drought_Events.csv')
+				save_manifest(manifest)
+				metrics['rows'], metrics['events'] = len(crop_complete), len(crop_events)
+				metrics['bytes_written'] = sum(Instrumentation.file_size(get_base_filepath()+'Final_Data/'+crop+suffix)
+											   for suffix in ['_Droughts.csv', '_Drought_Events.csv'])
+	finally:
+		if pool is not None:
+			pool.shutdown()
+	if pool is None:
+		print('\nWeather files read: '+str(cache_stats['misses'])+', reused from memory: '+str(cache_stats['hits']))
+
+
+
+#---------------------------------------------------------------------------
+# Method to read the cleaned yield data and areas of interest from 
+# base_filepath into the variables above. main() always reads them again,
+# other programs importing this file (like the benchmarks) can point 
+# base_filepath elsewhere and let require_data() read them when first used.
+#---------------------------------------------------------------------------
+def load_data():
+	global corn_yield, soybean_yield, wheat_yield, corn_counties, soybean_counties, wheat_counties, areas_of_interest
+
+	# Import data into pandas DataFrames (ANSI codes are read as integers and names as categories)
+	corn_yield = pd.read_csv(get_base_filepath()+'Cleaned_Corn_Yield.csv', dtype=Schema.yield_dtypes)
+	soybean_yield = pd.read_csv(get_base_filepath()+'Cleaned_Soybean_Yield.csv', dtype=Schema.yield_dtypes)
+	wheat_yield = pd.read_csv(get_base_filepath()+'Cleaned_Wheat_Yield.csv', dtype=Schema.yield_dtypes)
+	areas_of_interest = pd.read_csv(get_base_filepath()+'Areas_of_Interest.csv', dtype=Schema.area_dtypes)
+
+	# Find the counties of interest for each specific crop
+	corn_counties = corn_yield['ANSI Code'].unique().tolist()
+	soybean_counties = soybean_yield['ANSI Code'].unique().tolist()
+	wheat_counties = wheat_yield['ANSI Code'].unique().tolist()
+
+	# Turns the ANSI codes into the indices of areas_of_interest
+	areas_of_interest.set_index('ANSI Code', inplace=True)
+
+def require_data():
+	if areas_of_interest is None:
+		load_data()
+
+@Settings.data_directory_changed
+def clear_data():
+	global areas_of_interest
+	areas_of_interest = None  # Read again from the new data directory when next needed
+
 
+#---------------------------------------------------------------------------
+# Method run when each worker process starts so that it reads its data and
+# weather from the same place as the main process, and records its metrics
+# and applies missing_policy the same way (workers started with spawn or
+# forkserver re-import every file, so nothing set at run time carries over).
+# The data and weather are only read once a worker first needs them.
+#---------------------------------------------------------------------------
+def set_worker_paths(data_directory, filepath, weather_filepath, record_metrics, metrics_filepath, profile_mode,
+					 missing_policy):
+	global base_filepath
+	Settings.set_data_directory(data_directory)
+	base_filepath = filepath
+	Weather_Store.weather_filepath = weather_filepath
+	Instrumentation.record_metrics = record_metrics
+	Instrumentation.metrics_filepath = metrics_filepath
+	Instrumentation.profile_mode = profile_mode
+	Weather_Validation.missing_policy = missing_policy
 
 
 #--------------------------------------------------------------------------------
-# Method definition to create and return the DataFrame with drought information.
+# Method definition to create and return the DataFrame with drought information
+# along with the DataFrame of individual droughts (the per-county loop used
+# when vectorized is False does not record individual droughts) and the 
+# input hash of every county/year combination. previous holds the results
+# of an earlier run (see load_previous_results()) to reuse where the inputs
+# have not changed.
 #--------------------------------------------------------------------------------
-def create_drought_data(crop_type):
+def create_drought_data(crop_type, vectorized=True, pool=None, previous=None):
+	require_data()
+
 	# Sets up loop and data file requirements depending on the type of crop
 	if (crop_type == 'Corn'):
 		yield_df = corn_yield
@@ -66,85 +177,379 @@ def create_drought_data(crop_type):
 		#counties = ['06095', '51057']  # TEMPORARY ASSIGNMENT, REMOVE LATER!!!
 		years = range(1991, 2020+1)
 		dates = ['-11-01', '-07-31']
-		return create_wheat_drought_data(yield_df=yield_df, counties=counties, years=list(years), dates=dates)
+		return create_wheat_drought_data(yield_df=yield_df, counties=counties, years=list(years), dates=dates, 
+										 vectorized=vectorized, pool=pool, previous=previous)
 	else:
 		raise Exception("Improper crop type submitted. Please pass 'corn', 'soybean', or 'wheat'.")
 
-	# Create new dataframes to store drought information for each crop using custom drought durations
-	droughts = pd.DataFrame(columns=['Year', 'County', 'State', 'Location', #'Yield Value',
-									 'Num_Short', 'Periods_S', 'Lengths_S',
-									 'Num_Med', 'Periods_M', 'Lengths_M',
-									 'Num_Long', 'Periods_L', 'Lengths_L',
-									 'Total Precipitation',
-									 'Short_Time', 'Med_Time', 'Long_Time',
-									 'Total Drought Time', 'Total Drought Percentage'])
-
-	# Create a new row in the DataFrame for each county/year combination
+	# Create a new row of drought data for each county/year combination
+	# (rows are collected in a list and turned into a DataFrame once at the end)
 	print(f'\nDrought calculations for {crop_type}:')
-	for county in counties:
-		print("Calculating drought data for "+areas_of_interest.loc[county, 'Location'])
-		state = areas_of_interest.loc[county, 'State Initial']
+	if vectorized:
+		input_hashes = get_input_hashes(yield_df=yield_df, dates=dates, start_offset=0)
+		records, events, hashes = calculate_all_droughts(counties=counties, years=years, dates=dates, pool=pool,
+														 input_hashes=input_hashes, previous=previous, 
+														 crop_type=crop_type)
+	else:
+		records, events, hashes = [], pd.DataFrame(columns=event_columns), {}
+		for county in counties:
+			print("Calculating drought data for "+areas_of_interest.loc[county, 'Location'])
+			state = areas_of_interest.loc[county, 'State Initial']
 
-		# Reads in the weather data set and sets the date column as the index
-		weather = pd.read_csv(base_filepath+'Weather_Data/'+state+'_AVGPrecip.csv')
-		weather['Date'] = pd.to_datetime(weather['Date'])
-		weather.set_index('Date', inplace=True)
+			# Gets the state's date-indexed precipitation data (only read from file once for all counties and crops)
+			weather = load_weather(state, 'AvgPrecip')
 
-		# For each year of interest
-		for year in years:
-			# Establish the growing season that crosses years
-			growth_season = pd.date_range(start=str(year)+dates[0], end=str(year)+dates[1])
+			# For each year of interest
+			for year in years:
+				# Establish the growing season that crosses years
+				growth_season = pd.date_range(start=str(year)+dates[0], end=str(year)+dates[1])
 
-			# Calculate the drought data for this county in this year and append it to the DataFrame
-			data = calculate_droughts(yield_df=yield_df, county=county, state=state, year=year, 
-									  growth_season=growth_season, weather_df=weather)
-			droughts = droughts.append(data, ignore_index=True)
+				# Calculate the drought data for this county in this year and add it to the list of rows
+				data = calculate_droughts(yield_df=yield_df, county=county, state=state, year=year, 
+										  growth_season=growth_season, weather_df=weather)
+				records.append(data)
 
-		# End of drought data for a single county, loop is repeated for more counties
+			# End of drought data for a single county, loop is repeated for more counties
 
+	droughts = Schema.apply_dtypes(pd.DataFrame(records, columns=drought_columns), Schema.drought_dtypes)
+	events = events.assign(Crop=pd.Categorical([crop_type.title()]*len(events)))[event_columns]
 	yield_df = yield_df[['Year', 'ANSI Code', 'Value']].rename(columns={'ANSI Code':'County', 'Value':'Yield Value'})
-	return droughts.merge(right=yield_df, how='left', on=['Year', 'County'])
+	return droughts.merge(right=yield_df, how='left', on=['Year', 'County']), events, hashes
 
 
 #---------------------------------------------------------------------------
 # Modified version of the original create_drought_data() method to support 
 # planting/harvesting in separate calendar years.
 #---------------------------------------------------------------------------
-def create_wheat_drought_data(yield_df, counties, years, dates, crop_type='wheat'):
-	# Create new dataframes to store drought information for each crop using custom drought durations
-	droughts = pd.DataFrame(columns=['Year', 'County', 'State', 'Location',
-									 'Num_Short', 'Periods_S', 'Lengths_S',
-									 'Num_Med', 'Periods_M', 'Lengths_M',
-									 'Num_Long', 'Periods_L', 'Lengths_L',
-									 'Total Precipitation',
-									 'Short_Time', 'Med_Time', 'Long_Time',
-									 'Total Drought Time', 'Total Drought Percentage'])
+def create_wheat_drought_data(yield_df, counties, years, dates, crop_type='wheat', vectorized=True, pool=None, 
+							  previous=None):
 	start_year = years.pop(0)
 
+	# Create a new row of drought data for each county/year combination
+	# (rows are collected in a list and turned into a DataFrame once at the end)
 	print(f'\nDrought calculations for {crop_type}:')
-	for county in counties:
-		print("Calculating drought data for "+areas_of_interest.loc[county, 'Location'])
-		state = areas_of_interest.loc[county, 'State Initial']
+	if vectorized:
+		input_hashes = get_input_hashes(yield_df=yield_df, dates=dates, start_offset=1)
+		records, events, hashes = calculate_all_droughts(counties=counties, years=years, dates=dates, start_offset=1, 
+														 pool=pool, input_hashes=input_hashes, previous=previous,
+														 crop_type=crop_type.title())
+	else:
+		records, events, hashes = [], pd.DataFrame(columns=event_columns), {}
+		for county in counties:
+			print("Calculating drought data for "+areas_of_interest.loc[county, 'Location'])
+			state = areas_of_interest.loc[county, 'State Initial']
 
-		# Reads in the weather data set and sets the date column as the index
-		weather = pd.read_csv(base_filepath+'Weather_Data/'+state+'_AVGPrecip.csv')
-		weather['Date'] = pd.to_datetime(weather['Date'])
-		weather.set_index('Date', inplace=True)
+			# Gets the state's date-indexed precipitation data (only read from file once for all counties and crops)
+			weather = load_weather(state, 'AvgPrecip')
 
-		# For each year of interest
-		for year in years:
-			# Establish the growing season that crosses years
-			growth_season = pd.date_range(start=str(year-1)+dates[0], end=str(year)+dates[1])
+			# For each year of interest
+			for year in years:
+				# Establish the growing season that crosses years
+				growth_season = pd.date_range(start=str(year-1)+dates[0], end=str(year)+dates[1])
 
-			# Calculate the drought data for this county in this year and append it to the DataFrame
-			data = calculate_droughts(yield_df=yield_df, county=county, state=state, year=year, 
-									  growth_season=growth_season, weather_df=weather)
-			droughts = droughts.append(data, ignore_index=True)
+				# Calculate the drought data for this county in this year and add it to the list of rows
+				data = calculate_droughts(yield_df=yield_df, county=county, state=state, year=year, 
+										  growth_season=growth_season, weather_df=weather)
+				records.append(data)
 
-		# End of drought data for a single county, loop is repeated for more counties
+			# End of drought data for a single county, loop is repeated for more counties
 
+	droughts = Schema.apply_dtypes(pd.DataFrame(records, columns=drought_columns), Schema.drought_dtypes)
+	events = events.assign(Crop=pd.Categorical([crop_type.title()]*len(events)))[event_columns]
 	yield_df = yield_df[['Year', 'ANSI Code', 'Value']].rename(columns={'ANSI Code':'County', 'Value':'Yield Value'})
-	return droughts.merge(right=yield_df, how='left', on=['Year', 'County'])
+	return droughts.merge(right=yield_df, how='left', on=['Year', 'County']), events, hashes
+
+
+#---------------------------------------------------------------------------
+# Method to calculate the drought data for every county/year combination
+# using the vectorized drought engine. Counties are grouped by state so that
+# each state's weather is loaded once and every county in the state is
+# calculated in one call per season. start_offset is the number of years 
+# before the harvest year that the growing season starts (1 for wheat).
+# When a process pool is given, each state is sent to a worker process.
+# When previous results are given, only the county/year combinations whose
+# input hash (input_hashes combined with the season's weather) changed are
+# recalculated and the rest are copied from the previous results.
+# Returns a list of data dictionaries and a DataFrame of individual droughts,
+# both in the same county-then-year order as the per-county loop no matter 
+# which order the states finish in, and the new hash of every combination.
+#---------------------------------------------------------------------------
+def calculate_all_droughts(counties, years, dates, start_offset=0, pool=None, input_hashes=None, previous=None,
+						   crop_type=None):
+	require_data()
+	input_hashes = {} if input_hashes is None else input_hashes
+	previous_hashes = {} if previous is None else previous['hashes']
+
+	# Group the counties of interest by state
+	state_counties = {}
+	for county in counties:
+		state_counties.setdefault(areas_of_interest.loc[county, 'State Initial'], []).append(county)
+
+	# Each state is only sent the hashes of its own counties
+	tasks = []
+	for state in state_counties:
+		keys = [season_key(county, year) for county in state_counties[state] for year in years]
+		tasks.append((state, state_counties[state], years, dates, start_offset,
+					  {key:input_hashes.get(key, '') for key in keys},
+					  {key:previous_hashes[key] for key in keys if key in previous_hashes}, crop_type))
+
+	if pool is None:
+		results = (calculate_state_task(*task) for task in tasks)
+	else:
+		futures = [pool.submit(calculate_state_task, *task) for task in tasks]
+		results = (future.result() for future in as_completed(futures))
+
+	# Collect the results and report progress as each state finishes
+	county_data = {county: [] for county in counties}
+	event_frames = []
+	hashes = {}
+	failed_states = []
+	for num_done, result in enumerate(results, 1):
+		if result['error'] is not None:
+			failed_states.append(result['state'])
+			print("Drought calculations failed for "+result['state']+":\n"+result['error'])
+			continue
+		print(f"Calculated drought data for {result['counties']} counties in {result['state']} "
+			  f"in {result['seconds']:.1f}s ({num_done}/{len(state_counties)} states, "
+			  f"{len(result['rows'])} of {len(result['hashes'])} seasons recalculated"
+			  + (f", {result['skipped']} skipped for missing weather)" if result['skipped'] > 0 else ")"))
+		for data in result['rows']:
+			county_data[data['County']].append(data)
+		event_frames += result['events']
+		hashes.update(result['hashes'])
+
+	if (len(failed_states) > 0):
+		raise Exception("Drought calculations failed for "+str(len(failed_states))+" states: "+', '.join(failed_states))
+
+	# Copy over the previous results of every county/year combination that was not recalculated
+	if previous is not None:
+		recalculated = {season_key(data['County'], data['Year']) for county in counties for data in county_data[county]}
+		reused = previous['droughts'].drop(columns=['Yield Value'])
+		reused = reused[season_key(reused['County'], reused['Year']).isin(set(hashes)-recalculated)]
+		for data in reused[drought_columns].to_dict('records'):
+			county_data[data['County']].append(data)
+		for county in counties:
+			county_data[county].sort(key=lambda data: data['Year'])
+
+		reused = previous['events']
+		reused = reused[season_key(reused['ANSI Code'], reused['Year']).isin(set(hashes)-recalculated)]
+		event_frames.append(reused.drop(columns=['Crop']))
+
+	# Sort the individual droughts by county (in the order given), then year, then start date
+	event_frames = [frame for frame in event_frames if len(frame) > 0]
+	if (len(event_frames) == 0):
+		events = pd.DataFrame(columns=event_columns)
+	else:
+		events = pd.concat(event_frames, ignore_index=True)
+		county_order = events['ANSI Code'].map({county:i for i, county in enumerate(counties)})
+		events = events.iloc[np.lexsort((events['Start'], events['Year'], county_order))].reset_index(drop=True)
+	return [data for county in counties for data in county_data[county]], events, hashes
+
+
+#---------------------------------------------------------------------------
+# Method to calculate the drought and heat data for every season of the
+# given counties in one state. This is the unit of work sent to worker
+# processes, so it loads its own weather and returns a dictionary with the
+# data rows, the individual drought DataFrames, the hash of every
+# county/year combination, the time taken, and the traceback of any error
+# instead of raising it. Combinations whose hash matches previous_hashes
+# are not recalculated, and ones missing precipitation are left out when
+# Weather_Validation.missing_policy is 'skip' (their number is returned as
+# 'skipped'). crop_type chooses the temperatures used for the heat data.
+# Each task is recorded in the metrics file and its calculations are
+# profiled when Instrumentation.profile_mode is set.
+#---------------------------------------------------------------------------
+def calculate_state_task(state, counties, years, dates, start_offset, input_hashes=None, previous_hashes=None,
+						 crop_type=None):
+	start_time = time.time()
+	input_hashes = {} if input_hashes is None else input_hashes
+	previous_hashes = {} if previous_hashes is None else previous_hashes
+	result = {'state':state, 'counties':len(counties), 'rows':[], 'events':[], 'hashes':{}, 'skipped':0, 'error':None}
+	try:
+		with Instrumentation.stage('drought_state', crop=crop_type, state=state, counties=len(counties)) as metrics, \
+			 Instrumentation.profile('drought_'+str(crop_type)+'_'+state):
+			# Gets the state's date-indexed weather (only read once per process for all counties and crops).
+			# The heat data is only calculated when the daily highs and lows have been downloaded.
+			weather = {'precip':load_weather(state, 'AvgPrecip')}
+			if (crop_type in Heat_Engine.crop_temperatures and has_weather(state, 'MaxTemp') 
+					and has_weather(state, 'MinTemp')):
+				weather['maxt'] = load_weather(state, 'MaxTemp')
+				weather['mint'] = load_weather(state, 'MinTemp')
+
+			# Rolling precipitation anomalies of every day, from running totals over the state's whole series
+			anomalies = Rolling_Precip.load_rolling_anomalies(state)
+
+			# For each year of interest
+			for year in years:
+				growth_season = pd.date_range(start=str(year-start_offset)+dates[0], end=str(year)+dates[1])
+
+				# Slice out the season of every element once as (days x counties) arrays (days and counties missing
+				# from a state's files get NaN rows and columns, so missing precipitation gives empty totals and
+				# heat data, or leaves the season out with the 'skip' policy)
+				season = {'precip':weather['precip'].reindex(index=growth_season, columns=counties).to_numpy(dtype=np.float64)}
+				for element in ['maxt', 'mint']:
+					if element in weather:
+						season[element] = weather[element].reindex(index=growth_season, columns=counties).to_numpy(dtype=np.float64)
+				for window, values in Rolling_Precip.season_anomalies(anomalies, growth_season, counties).items():
+					season['anomaly_'+str(window)] = values
+
+				# With the 'skip' policy, counties missing any of the season's precipitation are left out of the
+				# data (and of the manifest, so an earlier result for the season is never reused)
+				skipped = np.zeros(len(counties), dtype=bool)
+				if (Weather_Validation.missing_policy == 'skip'):
+					skipped = np.isnan(season['precip']).any(axis=0)
+				result['skipped'] += int(skipped.sum())
+
+				# Hash each county's inputs for the season and only recalculate the ones that changed
+				changed = []
+				for i, county in enumerate(counties):
+					if skipped[i]:
+						continue
+					key = season_key(county, year)
+					result['hashes'][key] = hash_inputs(input_hashes.get(key, ''), 
+														*[np.ascontiguousarray(season[element][:, i]) for element in season])
+					if (result['hashes'][key] != previous_hashes.get(key)):
+						changed.append(i)
+				if (len(changed) == 0):
+					continue
+
+				rows, events = calculate_state_droughts(counties=[counties[i] for i in changed], state=state, year=year,
+														growth_season=growth_season, 
+														season={element: season[element][:, changed] for element in season},
+														crop_type=crop_type)
+				result['rows'] += rows
+				result['events'].append(events)
+			metrics['rows'] = len(result['rows'])
+			metrics['seasons'] = len(result['hashes'])
+			metrics['skipped'] = result['skipped']
+	except Exception:
+		result['error'] = traceback.format_exc()
+	result['seconds'] = time.time()-start_time
+	return result
+
+
+#---------------------------------------------------------------------------
+# Method to return whether an element's weather has been downloaded for a state
+#---------------------------------------------------------------------------
+def has_weather(state, element):
+	if (Weather_Store.use_binary_store and Weather_Store.state_in_store(state, element)):
+		return True
+	return os.path.exists(os.path.expanduser(Weather_Store.get_weather_filepath()+state+'_'+element+'.csv'))
+
+
+#---------------------------------------------------------------------------
+# Method to return a hash of the given inputs (strings or arrays)
+#---------------------------------------------------------------------------
+def hash_inputs(*inputs):
+	hasher = hashlib.sha1()
+	for item in inputs:
+		hasher.update(item.encode() if isinstance(item, str) else item.tobytes())
+	return hasher.hexdigest()
+
+
+#---------------------------------------------------------------------------
+# Method to return the input hash of each county/year combination of a crop
+# (keyed as 'ANSI Code|Year') from its yield rows and the settings used to
+# calculate its droughts. The weather is added to the hash when the drought
+# data is calculated.
+#---------------------------------------------------------------------------
+def get_input_hashes(yield_df, dates, start_offset):
+	settings = json.dumps({'dates':dates, 'start_offset':start_offset, 'columns':drought_columns,
+						   'dry_threshold':Drought_Engine.dry_threshold, 
+						   'lengths':[Drought_Engine.short_min, Drought_Engine.med_min, Drought_Engine.long_min],
+						   'temperatures':Heat_Engine.crop_temperatures, 'hot_dry_min':Heat_Engine.hot_dry_min,
+						   'rolling_windows':Rolling_Precip.rolling_windows,
+						   'climatology_years':Rolling_Precip.climatology_years,
+						   'missing_policy':Weather_Validation.missing_policy})
+	keys = season_key(yield_df['ANSI Code'], yield_df['Year'])
+	return {key:hash_inputs(settings, repr(value)) for key, value in zip(keys, yield_df['Value'].tolist())}
+
+
+#---------------------------------------------------------------------------
+# Method to return the manifest key ('ANSI Code|Year', ex. '01049|2020') of
+# a county and year (or of Series of them)
+#---------------------------------------------------------------------------
+def season_key(county, year):
+	if isinstance(county, pd.Series):
+		return Schema.format_fips(county)+'|'+year.astype(str)
+	return Schema.format_fips([county])[0]+'|'+str(year)
+
+
+#---------------------------------------------------------------------------
+# Methods to read and write the manifest holding the input hash of every
+# county/year combination from the last run of each crop
+#---------------------------------------------------------------------------
+def load_manifest():
+	manifest_file = os.path.expanduser(get_base_filepath()+'Final_Data/manifest.json')
+	if not os.path.exists(manifest_file):
+		return {}
+	with open(manifest_file) as file:
+		return json.load(file)
+
+def save_manifest(manifest):
+	manifest_file = os.path.expanduser(get_base_filepath()+'Final_Data/manifest.json')
+	with open(manifest_file+'.tmp', 'w') as file:
+		json.dump(manifest, file)
+	os.replace(manifest_file+'.tmp', manifest_file)
+
+
+#---------------------------------------------------------------------------
+# Method to read the results of the last run for a crop so they can be 
+# reused. Returns None if there are no previous results to reuse.
+#---------------------------------------------------------------------------
+def load_previous_results(crop_type, manifest):
+	droughts_file = get_base_filepath()+'Final_Data/'+crop_type+'_Droughts.csv'
+	events_file = get_base_filepath()+'Final_Data/'+crop_type+'_Drought_Events.csv'
+	if (crop_type not in manifest or not os.path.exists(os.path.expanduser(droughts_file)) 
+			or not os.path.exists(os.path.expanduser(events_file))):
+		return None
+
+	droughts = pd.read_csv(droughts_file, dtype=Schema.drought_dtypes, float_precision='round_trip')
+	if (list(droughts.columns) != drought_columns+['Yield Value']):
+		return None  # Written by an older version with different columns
+	events = pd.read_csv(events_file, parse_dates=['Start', 'End'], dtype=Schema.event_dtypes)
+	return {'hashes':manifest[crop_type], 'droughts':droughts, 'events':events}
+
+
+#---------------------------------------------------------------------------
+# Method to calculate the drought and heat data for all given counties of a
+# state in one growing season then returns the data as a list of
+# dictionaries (one per county, in the order given) and a DataFrame with one
+# row per drought. season holds the (days x counties) arrays of the season's
+# precipitation ('precip') and, when available, daily highs and lows ('maxt'
+# and 'mint') in degrees F. Without them the heat columns are left empty.
+# The rolling precipitation anomalies of the season ('anomaly_30' and so on,
+# see Rolling_Precip.py) are summarized into the rolling columns when given.
+#---------------------------------------------------------------------------
+def calculate_state_droughts(counties, state, year, growth_season, season, crop_type=None):
+	require_data()
+
+	# Find every drought at once, then the heat data from the same season arrays
+	droughts, events = calculate_season_droughts(season['precip'], growth_season)
+	if ('maxt' in season and 'mint' in season and crop_type in Heat_Engine.crop_temperatures):
+		droughts.update(calculate_season_heat(season['maxt'], season['mint'], season['precip'], 
+											  Heat_Engine.crop_temperatures[crop_type]))
+	else:
+		droughts.update({column:[np.nan]*len(counties) for column in heat_columns})
+	if all('anomaly_'+str(window) in season for window in Rolling_Precip.rolling_windows):
+		droughts.update(calculate_season_anomalies({window: season['anomaly_'+str(window)]
+													for window in Rolling_Precip.rolling_windows}))
+
+	data_list = []
+	for i, county in enumerate(counties):
+		data = {'Year':year, 'County':county, 'State':state, 
+				'Location':areas_of_interest.loc[county, 'Location']}
+		for column in droughts:
+			data[column] = droughts[column][i]
+		data_list.append(data)
+
+	# Individual droughts stored with compact types (integer ANSI codes, years, and lengths)
+	events = pd.DataFrame({'ANSI Code':np.asarray(counties).astype(np.int32)[events['county']],
+						   'Year':np.full(len(events['county']), year, dtype=np.int16),
+						   'Start':events['start'], 'End':events['end'], 
+						   'Length':events['length'].astype(np.int16),
+						   'Bucket':pd.Categorical.from_codes(events['bucket'], categories=bucket_names)})
+	return data_list, events
 
 
 #---------------------------------------------------------------------------
@@ -153,6 +558,8 @@ def create_wheat_drought_data(yield_df, counties, years, dates, crop_type='wheat
 # actual calculations.
 #---------------------------------------------------------------------------
 def calculate_droughts(yield_df, county, state, year, growth_season, weather_df):
+	require_data()
+
 	# Count the number of short, medium, and long length droughts
 	cur_len = 0
 	s_date, e_date = '', ''
@@ -192,9 +599,9 @@ def calculate_droughts(yield_df, county, state, year, growth_season, weather_df)
 			elif (cur_len in range(9,15)):  # Medium Drought
 				num_med += 1
 				total_m += cur_len
-				if (periods_s!='' and lengths_s!=''):
-					periods_s += ', '+str(s_date.date())+' to '+str(e_date.date())
-					lengths_s += ', '+str(cur_len)
+				if (periods_m!='' and lengths_m!=''):
+					periods_m += ', '+str(s_date.date())+' to '+str(e_date.date())
+					lengths_m += ', '+str(cur_len)
 				else:
 					periods_m = str(s_date.date())+' to '+str(e_date.date())
 					lengths_m = str(cur_len)
@@ -234,7 +641,9 @@ def calculate_droughts(yield_df, county, state, year, growth_season, weather_df)
 
 # ----------------------------------------------
 # Run the main method to run the important code
+# (guarded so worker processes can import this file without starting over)
 # ----------------------------------------------
-main()
+if __name__ == '__main__':
+	main()
 
-print('Data has been processed and drought data has been calculated.')
+	print('Data has been processed and drought data has been calculated.')
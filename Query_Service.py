@@ -0,0 +1,283 @@
+# Code to look up the final drought and yield data by crop, ANSI code, state, and year, locally or over HTTP
+#
+# Usage: python Query_Service.py [port], then for example
+#   http://localhost:8766/droughts?crop=Corn&ansi=17079&start=2005&end=2012  (one row per season)
+#   http://localhost:8766/summary?crop=Corn&state=IL&start=2005&end=2012      (statistics of each column)
+#   http://localhost:8766/stats                                               (result cache counts)
+
+
+# Editable variables
+# The Processed_Data directory (None uses the one in the data directory set in Settings.py)
+base_filepath = None
+
+# Crops whose final drought data is loaded
+crop_list = ['Corn', 'Soybean', 'Wheat']
+
+# Port the HTTP endpoint listens on (only on this computer)
+port = 8766
+
+# Number of summary results kept in memory, the least recently used are dropped first
+max_cached_results = 256
+
+
+# Importing necessary packages
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+import Settings
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import Instrumentation
+import Schema
+from Aggregate_Cube import cube_metrics
+
+
+# The drought data of every crop sorted by crop, ANSI code, and year, and its indexes
+# (built by load_query_index() the first time a query needs them, and again whenever
+# the drought data files change)
+query_index = None
+query_index_lock = threading.Lock()
+
+# Cache of summary results keyed by query, ordered from least to most recently used
+result_cache = OrderedDict()
+result_cache_stats = {'hits':0, 'misses':0, 'evictions':0}
+result_cache_lock = threading.Lock()
+
+
+#---------------------------------------------------------------------------
+# Method to return the directory this file reads from and writes to
+# (base_filepath, or the Processed_Data directory set in Settings.py)
+#---------------------------------------------------------------------------
+def get_base_filepath():
+	return Settings.paths['processed'] if base_filepath is None else base_filepath
+
+
+#---------------------------------------------------------------------------
+# Method to return a sortable key for each row from its crop, location
+# (ANSI code or state), and year codes. The year takes the lowest 4 digits
+# and the location the next 5, so keys sort by crop, then location, then
+# year, and every season of a location is one contiguous range of keys.
+#---------------------------------------------------------------------------
+def make_keys(crop_codes, location_codes, years):
+	return (np.asarray(crop_codes, dtype=np.int64)*100000 + np.asarray(location_codes, dtype=np.int64))*10000 \
+		   + np.asarray(years, dtype=np.int64)
+
+
+#---------------------------------------------------------------------------
+# Method to read the final drought data of every crop and build its
+# indexes. The rows are sorted by (crop, ANSI code, year), so the keys of
+# that order are the primary index, and the state index holds the keys of
+# (crop, state, year) sorted along with the rows they point to. Lookups on
+# either are two binary searches. Clears the result cache.
+#---------------------------------------------------------------------------
+def load_query_index():
+	global query_index
+	mtimes = data_mtimes()
+	tables = []
+	with Instrumentation.stage('load_query_index') as metrics:
+		for crop in crop_list:
+			Schema.require_columns(get_base_filepath()+'Final_Data/'+crop+'_Droughts.csv',
+								   ['Year', 'County', 'State', 'Location']+cube_metrics)
+			table = pd.read_csv(get_base_filepath()+'Final_Data/'+crop+'_Droughts.csv', dtype=Schema.drought_dtypes,
+								float_precision='round_trip')
+			table.insert(0, 'Crop', crop)
+			tables.append(table)
+		metrics['rows'] = sum(len(table) for table in tables)
+		metrics['bytes_read'] = sum(Instrumentation.file_size(get_base_filepath()+'Final_Data/'+crop+'_Droughts.csv')
+									for crop in crop_list)
+	# (the categories of each crop differ, so the names are joined as strings and made categories again)
+	table = pd.concat(tables, ignore_index=True).astype({'State':str, 'Location':str})
+	table = Schema.apply_dtypes(table, Schema.drought_dtypes).astype({'Crop':pd.CategoricalDtype(crop_list)})
+	table = table.sort_values(['Crop', 'County', 'Year'], ignore_index=True)
+
+	crop_codes, state_codes = table['Crop'].cat.codes.to_numpy(), table['State'].cat.codes.to_numpy()
+	state_keys = make_keys(crop_codes, state_codes, table['Year'])
+	state_rows = np.argsort(state_keys, kind='stable')
+	query_index = {'table':table, 'keys':make_keys(crop_codes, table['County'], table['Year']),
+				   'state_keys':state_keys[state_rows], 'state_rows':state_rows,
+				   'crops':list(table['Crop'].cat.categories), 'states':list(table['State'].cat.categories),
+				   'loaded':time.time(), 'mtimes':mtimes}
+	clear_result_cache()
+	return query_index
+
+def require_index():
+	with query_index_lock:
+		if (query_index is None or query_index['mtimes'] != data_mtimes()):
+			load_query_index()
+		return query_index
+
+
+#---------------------------------------------------------------------------
+# Method to forget the index and results loaded from the old data directory
+# (the index is loaded again from the new one when next queried)
+#---------------------------------------------------------------------------
+@Settings.data_directory_changed
+def clear_query_index():
+	global query_index
+	with query_index_lock:
+		query_index = None
+	clear_result_cache()
+
+
+#---------------------------------------------------------------------------
+# Method to return the modification time of each crop's final drought data
+# file (None for a missing file), so the index is rebuilt once any of them
+# is rewritten by Process_Data.py
+#---------------------------------------------------------------------------
+def data_mtimes():
+	paths = [os.path.expanduser(get_base_filepath()+'Final_Data/'+crop+'_Droughts.csv') for crop in crop_list]
+	return [os.path.getmtime(path) if os.path.exists(path) else None for path in paths]
+
+
+#---------------------------------------------------------------------------
+# Method to return the positions of the first and last keys of a location's
+# seasons from start to end (inclusive, every year when None) in a sorted
+# key array, found by binary search. Unknown crops give an empty range.
+#---------------------------------------------------------------------------
+def key_range(keys, crop, location_code, start=None, end=None):
+	index = require_index()
+	if crop not in index['crops'] or location_code is None:
+		return 0, 0
+	crop_code = index['crops'].index(crop)
+	first = make_keys(crop_code, location_code, 0 if start is None else int(start))
+	last = make_keys(crop_code, location_code, 9999 if end is None else int(end))
+	return np.searchsorted(keys, first, side='left'), np.searchsorted(keys, last, side='right')
+
+
+#---------------------------------------------------------------------------
+# Methods to return the drought data rows (one per season) of a county,
+# given by its ANSI code (ex. 17079 or '17079'), or of every county in a
+# state, given by its initials (ex. 'IL'), from start to end (inclusive)
+#---------------------------------------------------------------------------
+def get_county_droughts(crop, ansi, start=None, end=None):
+	index = require_index()
+	first, last = key_range(index['keys'], crop, int(ansi), start, end)
+	return index['table'].iloc[first:last]
+
+def get_state_droughts(crop, state, start=None, end=None):
+	index = require_index()
+	state_code = index['states'].index(state) if state in index['states'] else None
+	first, last = key_range(index['state_keys'], crop, state_code, start, end)
+	return index['table'].iloc[np.sort(index['state_rows'][first:last])]
+
+
+#---------------------------------------------------------------------------
+# Method to return the count, mean, standard deviation, minimum, and maximum
+# of each drought and yield column of a county (ansi) or state from start to
+# end, as a DataFrame with one row per column. Results are kept in a cache
+# of the max_cached_results most recently used queries, so repeating a
+# query does not look up or summarize the rows again (the cache is cleared
+# whenever the drought data changes).
+#---------------------------------------------------------------------------
+def summarize_droughts(crop, ansi=None, state=None, start=None, end=None):
+	require_index()
+	key = (crop, None if ansi is None else int(ansi), state,
+		   None if start is None else int(start), None if end is None else int(end))
+	with result_cache_lock:
+		if key in result_cache:
+			result_cache_stats['hits'] += 1
+			result_cache.move_to_end(key)
+			return result_cache[key]
+		result_cache_stats['misses'] += 1
+
+	if ansi is not None:
+		rows = get_county_droughts(crop, ansi, start, end)
+	else:
+		rows = get_state_droughts(crop, state, start, end)
+	metrics = [metric for metric in cube_metrics if metric in rows.columns]
+	summary = rows[metrics].agg(['count', 'mean', 'std', 'min', 'max']).T
+
+	with result_cache_lock:
+		result_cache[key] = summary
+		while (len(result_cache) > max_cached_results):
+			result_cache.popitem(last=False)
+			result_cache_stats['evictions'] += 1
+	return summary
+
+
+#---------------------------------------------------------------------------
+# Method to empty the result cache (done whenever the data is reloaded)
+#---------------------------------------------------------------------------
+def clear_result_cache():
+	with result_cache_lock:
+		result_cache.clear()
+
+
+#---------------------------------------------------------------------------
+# Request handler that answers GET requests for /droughts, /summary, and
+# /stats with JSON. /droughts and /summary take crop and either ansi or
+# state, and optionally start and end years. Bad requests get a 400 error
+# and any other failure a 500 error, both with a JSON message.
+#---------------------------------------------------------------------------
+class QueryHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		url = urlparse(self.path)
+		params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+		try:
+			if (url.path == '/stats'):
+				index = require_index()
+				body = json.dumps({'rows':len(index['table']), 'loaded':index['loaded'],
+								   'cached_results':len(result_cache), **result_cache_stats})
+			elif (url.path in ['/droughts', '/summary']):
+				if 'crop' not in params or ('ansi' in params) == ('state' in params):
+					raise ValueError("Please pass crop and either ansi or state.")
+				if (url.path == '/droughts'):
+					if 'ansi' in params:
+						rows = get_county_droughts(params['crop'], params['ansi'], params.get('start'), params.get('end'))
+					else:
+						rows = get_state_droughts(params['crop'], params['state'], params.get('start'), params.get('end'))
+					body = rows.assign(County=Schema.format_fips(rows['County'])).to_json(orient='records')
+				else:
+					summary = summarize_droughts(params['crop'], params.get('ansi'), params.get('state'),
+												 params.get('start'), params.get('end'))
+					body = summary.to_json(orient='index')
+			else:
+				self.send_json(404, json.dumps({'error':'Unknown path '+url.path}))
+				return
+		except ValueError as e:
+			self.send_json(400, json.dumps({'error':str(e)}))
+			return
+		except Exception as e:
+			self.send_json(500, json.dumps({'error':type(e).__name__+': '+str(e)}))
+			return
+		self.send_json(200, body)
+
+	def send_json(self, status, body):
+		body = body.encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass  # Keep the console quiet
+
+
+#---------------------------------------------------------------------------
+# Method to load the data, start the HTTP endpoint on a background thread,
+# and return it (call server.shutdown() to stop it)
+#---------------------------------------------------------------------------
+def start_query_server(port=port):
+	require_index()
+	server = ThreadingHTTPServer(('localhost', port), QueryHandler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+
+# Run the endpoint until stopped when this file is run directly (usage: python Query_Service.py [port])
+if __name__ == '__main__':
+	if (len(sys.argv) > 1):
+		port = int(sys.argv[1])
+	server = start_query_server(port)
+	print("Query service running at http://localhost:"+str(port)+"/ (press Ctrl+C to stop)")
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		server.shutdown()
@@ -3,111 +3,186 @@
 
 
 # Editable variables
-base_filepath = '~/'
 
-# Import needed packages
-import pandas as pd
-
-
-# Import data into pandas DataFrames
-yield_data_path = base_filepath + 'Raw_Data/Yield_Data/'
-
-corn_yield_1 = pd.read_csv(yield_data_path + "Corn Yield - Alabama to Oklahoma.csv")
-corn_yield_2 = pd.read_csv(yield_data_path + "Corn Yield - Oregon to Wyoming.csv")
-corn_yield = pd.concat([corn_yield_1, corn_yield_2])
-del corn_yield_1
-del corn_yield_2
-
-soybean_yield = pd.read_csv(yield_data_path + "Soybean Yield - All Regions.csv")
-
-wheat_yield = pd.read_csv(yield_data_path + "Wheat Yield - All Regions.csv")
-
-
-
-# Clean data by removing unnecessary columns from corn, soybean, & wheat yield data
-unneeded_yield_columns = ['Program', 'Period', 'Week Ending', 'Geo Level', 
-				 		  'Zip Code', 'Region', 'watershed_code', 'Watershed', 
-				 		  'Commodity', 'Data Item', 'Domain', 'Domain Category', 
-				 		  'Ag District Code', 'CV (%)']
-corn_yield = corn_yield.drop(unneeded_yield_columns, axis=1)
-soybean_yield = soybean_yield.drop(unneeded_yield_columns, axis=1)
-wheat_yield = wheat_yield.drop(unneeded_yield_columns, axis=1)
-del unneeded_yield_columns
-
-
-# Sorts yield data columns by Year, then State, then County
-corn_yield = corn_yield.sort_values(by=['Year', 'State', 'County'], ascending=[False, True, True])
-soybean_yield = soybean_yield.sort_values(by=['Year', 'State', 'County'], ascending=[False, True, True])
-wheat_yield = wheat_yield.sort_values(by=['Year', 'State', 'County'], ascending=[False, True, True])
-
-
-# Removes row values with a county of Other (prevents misc data from affecting values)
-corn_yield = corn_yield[corn_yield['County'] != 'OTHER COUNTIES']
-soybean_yield = soybean_yield[soybean_yield['County'] != 'OTHER COUNTIES']
-wheat_yield = wheat_yield[wheat_yield['County'] != 'OTHER COUNTIES']
-corn_yield = corn_yield[corn_yield['County'] != 'OTHER (COMBINED) COUNTIES']
-soybean_yield = soybean_yield[soybean_yield['County'] != 'OTHER (COMBINED) COUNTIES']
-wheat_yield = wheat_yield[wheat_yield['County'] != 'OTHER (COMBINED) COUNTIES']
-
-
-# Converts State, County, and Ag District names to title case (aka proper case)
-cols = ['State', 'County', 'Ag District']
-for col in cols:
-	corn_yield[col] = corn_yield[col].str.title()
-	soybean_yield[col] = soybean_yield[col].str.title()
-	wheat_yield[col] = wheat_yield[col].str.title()
-del cols
+# The directory holding the Raw_Data and Processed_Data directories (None uses the data directory set in Settings.py)
+base_filepath = None
 
+# Raw QuickStats yield files of each crop (in Raw_Data/Yield_Data). Every crop listed is
+# cleaned and written to Processed_Data/Cleaned_<crop>_Yield.csv, so more commodities can be
+# added by downloading their files and adding them here.
+crop_files = {'Corn':["Corn Yield - Alabama to Oklahoma.csv", "Corn Yield - Oregon to Wyoming.csv"],
+			  'Soybean':["Soybean Yield - All Regions.csv"],
+			  'Wheat':["Wheat Yield - All Regions.csv"]}
 
-# Creates a new column to store the State-County combination
-# This allows for the differentiation of same-named counties in different states (ex. Washington County)
-corn_yield['Location'] = corn_yield['County'] + ' County, ' + corn_yield['State']
-soybean_yield['Location'] = soybean_yield['County'] + ' County, ' + soybean_yield['State']
-wheat_yield['Location'] = wheat_yield['County'] + ' County, ' + wheat_yield['State']
+# Number of rows of a raw file read into memory at a time
+chunk_size = 100000
 
+# Number of years of yields a county needs to be kept (1991 up to 2020 is 30 years)
+min_years = 30
 
-# Creates a new column to store the complete ANSI (FIPS) code (used in retrieving weather data)
-corn_yield['ANSI Code'] = corn_yield['State ANSI'].astype(str).str.zfill(2) + corn_yield['County ANSI'].astype(int).astype(str).str.zfill(3)
-soybean_yield['ANSI Code'] = soybean_yield['State ANSI'].astype(str).str.zfill(2) + soybean_yield['County ANSI'].astype(int).astype(str).str.zfill(3)
-wheat_yield['ANSI Code'] = wheat_yield['State ANSI'].astype(str).str.zfill(2) + wheat_yield['County ANSI'].astype(int).astype(str).str.zfill(3)
-# Now removes partial ANSI code columns from DataFrames
-corn_yield = corn_yield.drop(['State ANSI', 'County ANSI'], axis=1)
-soybean_yield = soybean_yield.drop(['State ANSI', 'County ANSI'], axis=1)
-wheat_yield = wheat_yield.drop(['State ANSI', 'County ANSI'], axis=1)
-
-
-# Subset yield data by counties with at 30 years of data (in other words, data must be complete)
-corn_yield = corn_yield[corn_yield.groupby('Location')['Location'].transform('count').ge(30)]
-soybean_yield = soybean_yield[soybean_yield.groupby('Location')['Location'].transform('count').ge(30)]
-wheat_yield = wheat_yield[wheat_yield.groupby('Location')['Location'].transform('count').ge(30)]
-
-
-# Create a new DataFrame to store the States, Counties, Locations, and ANSI codes of interest
-corn_subset = corn_yield[['State', 'County', 'Location', 'ANSI Code']].drop_duplicates()
-soybean_subset = soybean_yield[['State', 'County', 'Location', 'ANSI Code']].drop_duplicates()
-wheat_subset = wheat_yield[['State', 'County', 'Location', 'ANSI Code']].drop_duplicates()
-areas_of_interest = pd.concat([corn_subset, soybean_subset, wheat_subset]).drop_duplicates().sort_values(by=['State', 'County'])
-
-
-# Add a new column to areas_of_interest to store the state initial (ex. 'IN' for Indiana)
-state_df = pd.read_csv(base_filepath + 'Raw_Data/State.csv', sep='|').drop(['STATE', 'STATENS'], axis=1)
-state_df.columns = ['State Initial', 'State']
-areas_of_interest = areas_of_interest.merge(state_df, how='inner', on='State')
-
-
-# Add state initial columns to Corn_Yield, Soybean_Yield, and Wheat_Yield DataFrames
-corn_yield = corn_yield.merge(state_df, how='inner', on='State')
-soybean_yield = soybean_yield.merge(state_df, how='inner', on='State')
-wheat_yield = wheat_yield.merge(state_df, how='inner', on='State')
-
-
-# Export processed DataFrames into new CSV files
-corn_yield.to_csv(r''+base_filepath+'Processed_Data/Cleaned_Corn_Yield.csv', index=False, header=True)
-soybean_yield.to_csv(r''+base_filepath+'Processed_Data/Cleaned_Soybean_Yield.csv', index=False, header=True)
-wheat_yield.to_csv(r''+base_filepath+'Processed_Data/Cleaned_Wheat_Yield.csv', index=False, header=True)
-areas_of_interest.to_csv(r''+base_filepath+'Processed_Data/Areas_of_Interest.csv', index=False, header=True)
-
-
-
-print("\nData reading & processing is now fully completed!\n")
-
+# Import needed packages
+import numpy as np
+import pandas as pd
+import Settings
+import Instrumentation
+import Schema
+
+
+# Columns of the QuickStats yield data that are read (the rest are never loaded)
+yield_columns = ['Year', 'State', 'State ANSI', 'Ag District', 'County', 'County ANSI', 'Value']
+
+# Columns of the cleaned yield files, in the order they are written
+cleaned_columns = ['Year', 'State', 'Ag District', 'County', 'Value', 'Location', 'ANSI Code', 'State Initial']
+
+# Columns of the cleaned yield data describing each county (collected for the areas of interest)
+area_columns = ['State', 'County', 'Location', 'ANSI Code']
+
+
+#---------------------------------------------------------------------------
+# Method to return the directory this file reads from and writes to
+# (base_filepath, or the data directory set in Settings.py)
+#---------------------------------------------------------------------------
+def get_base_filepath():
+	return Settings.paths['data'] if base_filepath is None else base_filepath
+
+
+# ---------------------------
+# 	   Main program code:
+# ---------------------------
+def main():
+	yield_data_path = get_base_filepath() + 'Raw_Data/Yield_Data/'
+	state_df = read_state_data(get_base_filepath() + 'Raw_Data/State.csv')
+
+	# Clean each crop's yield data a chunk at a time, writing its cleaned file as it goes
+	crop_areas = []
+	for crop in crop_files:
+		yield_paths = [yield_data_path + file_name for file_name in crop_files[crop]]
+		output_path = get_base_filepath()+'Processed_Data/Cleaned_'+crop+'_Yield.csv'
+		with Instrumentation.stage('clean_yields', crop=crop) as metrics:
+			areas, metrics['rows'], metrics['rows_written'] = read_yield_data(yield_paths, output_path, state_df)
+			crop_areas.append(areas)
+			metrics['bytes_read'] = sum(Instrumentation.file_size(path) for path in yield_paths)
+			metrics['bytes_written'] = Instrumentation.file_size(output_path)
+
+	# Create a new DataFrame to store the States, Counties, Locations, ANSI codes, and state initials of interest
+	# and export it into a new CSV file (ANSI codes are zero-padded in the files)
+	areas_of_interest = get_areas_of_interest(crop_areas, state_df)
+	with Instrumentation.stage('write_yields') as metrics:
+		Schema.to_csv(areas_of_interest, r''+get_base_filepath()+'Processed_Data/Areas_of_Interest.csv')
+		metrics['bytes_written'] = Instrumentation.file_size(get_base_filepath()+'Processed_Data/Areas_of_Interest.csv')
+		metrics['rows'] = len(areas_of_interest)
+
+
+#---------------------------------------------------------------------------
+# Method to clean one crop's raw QuickStats yield files and write the rows
+# of counties with complete data to output_path (with state initials from
+# state_df added). The files are read twice, chunk_size rows at a time and
+# with only the needed columns: the first pass counts the years of every
+# county, and the second cleans each chunk, keeps the counties with at least
+# min_years years, and appends them to the output file before the next
+# chunk is read. Only one chunk and the per-county counts are ever held in
+# memory, however large the files are, so the rows are written in the order
+# of the raw files rather than sorted. Returns the States, Counties,
+# Locations, and ANSI codes of the counties kept, the number of raw rows
+# read, and the number of rows written.
+#---------------------------------------------------------------------------
+def read_yield_data(yield_paths, output_path, state_df):
+	year_counts = count_location_years(yield_paths)
+	complete = year_counts.index[year_counts >= min_years]
+
+	Schema.to_csv(pd.DataFrame(columns=cleaned_columns), output_path)
+	areas, num_rows, num_written = pd.DataFrame(columns=area_columns), 0, 0
+	for chunk in read_yield_chunks(yield_paths, yield_columns):
+		num_rows += len(chunk)
+		chunk = clean_yield_chunk(chunk)
+		chunk = chunk[chunk['Location'].isin(complete)].merge(state_df, how='inner', on='State')
+		chunk = chunk[cleaned_columns]
+		Schema.to_csv(chunk, output_path, append=True)
+		areas = pd.concat([areas, chunk[area_columns].astype(str)]).drop_duplicates()
+		num_written += len(chunk)
+	return areas, num_rows, num_written
+
+
+#---------------------------------------------------------------------------
+# Method to read a crop's raw yield files chunk_size rows at a time, 
+# yielding one DataFrame of the given columns per chunk
+#---------------------------------------------------------------------------
+def read_yield_chunks(yield_paths, columns):
+	for path in yield_paths:
+		reader = pd.read_csv(path, usecols=columns, chunksize=chunk_size,
+							 dtype={column:str for column in ['State', 'Ag District', 'County'] if column in columns})
+		for chunk in reader:
+			yield chunk
+
+
+#---------------------------------------------------------------------------
+# Method to count the rows (years) of every county in a crop's raw yield
+# files, reading only the State and County columns. Returns a Series of
+# counts indexed by Location.
+#---------------------------------------------------------------------------
+def count_location_years(yield_paths):
+	counts = pd.Series(dtype=np.int64)
+	for chunk in read_yield_chunks(yield_paths, ['State', 'County']):
+		chunk_counts = clean_yield_names(chunk)['Location'].value_counts()
+		counts = counts.add(chunk_counts, fill_value=0).astype(np.int64)
+	return counts
+
+
+#---------------------------------------------------------------------------
+# Method to read the state names and initials (ex. 'IN' for Indiana)
+#---------------------------------------------------------------------------
+def read_state_data(state_path):
+	state_df = pd.read_csv(state_path, sep='|').drop(['STATE', 'STATENS'], axis=1)
+	state_df.columns = ['State Initial', 'State']
+	return Schema.apply_dtypes(state_df, Schema.name_dtypes)
+
+
+#---------------------------------------------------------------------------
+# Method to clean the names of one chunk of a crop's raw yield data (only
+# the State and County columns are needed) and add its Location column
+#---------------------------------------------------------------------------
+def clean_yield_names(yield_df):
+	# Removes row values with a county of Other (prevents misc data from affecting values)
+	yield_df = yield_df[~yield_df['County'].isin(['OTHER COUNTIES', 'OTHER (COMBINED) COUNTIES'])].copy()
+
+	# Converts State, County, and Ag District names to title case (aka proper case)
+	for col in ['State', 'County', 'Ag District']:
+		if col in yield_df.columns:
+			yield_df[col] = yield_df[col].str.title()
+
+	# Creates a new column to store the State-County combination
+	# This allows for the differentiation of same-named counties in different states (ex. Washington County)
+	yield_df['Location'] = yield_df['County'] + ' County, ' + yield_df['State']
+	return yield_df
+
+
+#---------------------------------------------------------------------------
+# Method to clean one chunk of a crop's raw yield data and return it
+#---------------------------------------------------------------------------
+def clean_yield_chunk(yield_df):
+	yield_df = clean_yield_names(yield_df)
+
+	# Creates a new column to store the complete ANSI (FIPS) code (used in retrieving weather data)
+	# as an integer (the state code times 1000 plus the county code), zero-padded only when written to a file
+	yield_df['ANSI Code'] = (yield_df['State ANSI'].astype(np.int32)*1000 + yield_df['County ANSI'].astype(np.int32))
+	# Now removes partial ANSI code columns from the DataFrame
+	return yield_df.drop(['State ANSI', 'County ANSI'], axis=1)
+
+
+#---------------------------------------------------------------------------
+# Method to return the States, Counties, Locations, ANSI codes, and state
+# initials of every county in any of the given DataFrames of counties kept
+# (as returned by read_yield_data())
+#---------------------------------------------------------------------------
+def get_areas_of_interest(crop_areas, state_df):
+	areas_of_interest = pd.concat(crop_areas).drop_duplicates().sort_values(by=['State', 'County'])
+	areas_of_interest = areas_of_interest.merge(state_df.astype(str), how='inner', on='State')
+	return Schema.apply_dtypes(areas_of_interest, Schema.area_dtypes)
+
+
+
+# Run the code in the main method
+if __name__ == '__main__':
+	main()
+
+	print("\nData reading & processing is now fully completed!\n")
@@ -4,58 +4,233 @@
 
 # Editable variables
 
-# The primary directory of the overall file
-base_filepath = '~/Processed_Data'
+# The primary directory of the overall file (None uses the Processed_Data directory of the
+# data directory set in Settings.py)
+base_filepath = None
 
 # Accepatable values in list are 'maxt', 'mint', 'avgt', 'pcpn'
 # for maximum temperature, minimum temperature, average temperature, and average precipitation respectively
-elems_of_interest = ['avgt', 'pcpn']
+elems_of_interest = ['avgt', 'maxt', 'mint', 'pcpn']
+
+# Name used in the weather file names for each element
+elem_file_names = {'maxt':'MaxTemp', 'mint':'MinTemp', 'avgt':'AvgTemp', 'pcpn':'AvgPrecip'}
+
+# The GridData endpoint (point this at ACIS_Stub_Server.py to test without network access)
+api_url = 'http://data.rcc-acis.org/GridData'
+
+# Number of API calls allowed to run at the same time
+max_concurrent_calls = 4
+
+# Number of times a failed API call is retried, and the delay (in seconds) before 
+# the first retry, which doubles after every further failure
+max_retries = 4
+retry_delay = 5
+
+# Every complete year of every API response is saved in Weather_Data/API_Cache so later calls
+# (for a longer date range, for example) only download the years that are missing. The least
+# recently used years are deleted once the cache is larger than max_api_cache_mb megabytes.
+use_api_cache = True
+max_api_cache_mb = 2048
 
 
 # Import needed packages
+import json
+import os
+import threading
+import time
 import pandas as pd 
 import requests
+import urllib3
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime as dt
+import numpy as np
+import Settings
+import Weather_Store
+import Weather_Validation
+import Instrumentation
+import Schema
+
+# Optional package: when installed the API response is decoded as it streams in
+# rather than being loaded into memory as one large dictionary first
+try:
+	import ijson
+except ImportError:
+	ijson = None
+
+
+# The ANSI codes of interest in each state (the only columns kept from the API responses,
+# read by main() or the first time an API call needs them)
+state_counties = {}
+
+
+#---------------------------------------------------------------------------
+# Method to return the directory this file reads from and writes to, without
+# a trailing '/' (base_filepath, or the Processed_Data directory set in
+# Settings.py)
+#---------------------------------------------------------------------------
+def get_base_filepath():
+	return Settings.paths['processed'][:-1] if base_filepath is None else base_filepath
 
 
-# Create a list of all states of interest from an imported CSV (897 total)
-areas_of_interest = pd.read_csv(base_filepath+'/Areas_of_Interest.csv')
-states_of_interest = set(areas_of_interest['State Initial'].unique())
+#---------------------------------------------------------------------------
+# Method to forget the ANSI codes of interest read from the old data
+# directory (they are read again from the new one when next needed)
+#---------------------------------------------------------------------------
+@Settings.data_directory_changed
+def clear_state_counties():
+	global state_counties
+	state_counties = {}
 
 
 #---------------------------------------------------------
 # Import weather data for all states and elements desired
 #---------------------------------------------------------
 def main():
-	# For each state of interest, retrieve the weather data for the desired period
-	num_errors = 0
+	global state_counties
+	states_of_interest, state_counties = load_areas_of_interest()
+	if base_filepath is not None:
+		Weather_Store.weather_filepath = base_filepath+'/Weather_Data/'
+
+	# Only make the API calls that have not already been completed by an earlier run
 	#states_of_interest = ['AL', 'CA', 'CO']  # TEMPORARY OBJECT ASSIGNMENT!!!!
 	#states_of_interest = ['CO']  # TEMPORARY OBJECT ASSIGNMENT!!!!
-	for state in states_of_interest: 
-		try:
-			for elem in elems_of_interest:
-				make_API_call(state, elem)
-		except Exception as e:
-			num_errors += 1
-			print("\nUnsuccessful API call for ANSI code "+state+" at "+dt.now().strftime("%I:%M%p on %d/%m/%Y"))
-			print("The error was: \n" + str(e) + "\n")
-		finally:
-			if (num_errors >= 5):
-				print("Too many unsuccessful API calls (n=5), progress has been halted")
-				quit()
+	completed = load_checkpoint()
+	calls = [(state, elem) for state in sorted(states_of_interest) for elem in elems_of_interest]
+	pending = [(state, elem) for state, elem in calls 
+			   if call_name(state, elem) not in completed or not os.path.exists(weather_file(state, elem))]
+	print(str(len(calls)-len(pending))+" of "+str(len(calls))+" API calls were already completed, "
+		  "making the remaining "+str(len(pending))+" with up to "+str(max_concurrent_calls)+" at a time")
+
+	# Make the API calls on a pool of threads, recording each one as soon as it finishes
+	num_errors = 0
+	with Instrumentation.stage('fetch_weather', calls=len(pending)) as metrics, \
+		 ThreadPoolExecutor(max_workers=max_concurrent_calls) as executor:
+		futures = {executor.submit(make_API_call_with_retries, state, elem): (state, elem) for state, elem in pending}
+		for future in as_completed(futures):
+			state, elem = futures[future]
+			try:
+				future.result()
+				# The binary store no longer matches the rewritten CSV file, so the CSV files are read until it is rebuilt
+				Weather_Store.remove_weather_store(elem_file_names[elem])
+				completed.add(call_name(state, elem))
+				save_checkpoint(completed)
+			except Exception as e:
+				num_errors += 1
+				print("\nUnsuccessful "+elem+" API call for "+state+" at "+dt.now().strftime("%I:%M%p on %d/%m/%Y"))
+				print("The error was: \n" + str(e) + "\n")
+		metrics['errors'] = num_errors
 	print("\nAPI calls have been made with " + str(num_errors) + 
-		  " total errors out of " + str(len(states_of_interest)) + " total states.")
+		  " total errors out of " + str(len(pending)) + " total calls.")
+	if (num_errors > 0):
+		print("Run this file again to retry only the unsuccessful calls and build the binary weather store.")
+
+	# Pack the downloaded CSV files into the binary weather store read by Process_Data.py
+	if (num_errors == 0):
+		for elem in elems_of_interest:
+			with Instrumentation.stage('weather_store', element=elem_file_names[elem]) as metrics:
+				Weather_Store.convert_weather_csvs(elem_file_names[elem])
+				metrics['bytes_written'] = Instrumentation.file_size(Weather_Store.store_path(elem_file_names[elem], '.f32'))
 
 	print("Weather data has successfully been cleaned and edited.\n")
 
 
+#---------------------------------------------------------------------
+# Method to return the set of states of interest and the ANSI codes of
+# interest in each state from the areas of interest CSV (897 counties total)
+#---------------------------------------------------------------------
+def load_areas_of_interest():
+	areas_of_interest = pd.read_csv(get_base_filepath()+'/Areas_of_Interest.csv', dtype=Schema.area_dtypes)
+	areas_of_interest['ANSI Code'] = Schema.format_fips(areas_of_interest['ANSI Code'])  # The API keys counties by string
+	states_of_interest = set(areas_of_interest['State Initial'].unique())
+	return states_of_interest, areas_of_interest.groupby('State Initial', observed=True)['ANSI Code'].unique().to_dict()
+
+def get_state_counties():
+	global state_counties
+	if (len(state_counties) == 0):
+		state_counties = load_areas_of_interest()[1]
+	return state_counties
+
+
+#---------------------------------------------------------------------
+# Method to return the CSV file path for a state and element
+#---------------------------------------------------------------------
+def weather_file(state, element):
+	return os.path.expanduser(get_base_filepath()+'/Weather_Data/'+state+'_'+elem_file_names[element]+'.csv')
+
+
+#---------------------------------------------------------------------
+# Methods to read and write the checkpoint file listing every completed
+# state/element API call (as 'STATE_elem_start_end' strings, so changing 
+# Settings.weather_dates makes the calls again). Entries written before the dates
+# were added ('STATE_elem') were all for 1991-01-01 to 2020-12-31.
+#---------------------------------------------------------------------
+def call_name(state, element):
+	return state+'_'+element+'_'+Settings.weather_dates[0]+'_'+Settings.weather_dates[1]
+
+def load_checkpoint():
+	checkpoint_file = os.path.expanduser(get_base_filepath()+'/Weather_Data/completed_calls.json')
+	if not os.path.exists(checkpoint_file):
+		return set()
+	with open(checkpoint_file) as file:
+		return set(call if call.count('_') > 1 else call+'_1991-01-01_2020-12-31' for call in json.load(file))
+
+def save_checkpoint(completed):
+	# Written to a temporary file first so an interrupted run never leaves a broken checkpoint
+	checkpoint_file = os.path.expanduser(get_base_filepath()+'/Weather_Data/completed_calls.json')
+	with open(checkpoint_file+'.tmp', 'w') as file:
+		json.dump(sorted(completed), file)
+	os.replace(checkpoint_file+'.tmp', checkpoint_file)
+
+
+#---------------------------------------------------------------------
+# Method to return this thread's requests session. Each thread keeps one
+# session so connections to the API are reused between calls.
+#---------------------------------------------------------------------
+thread_data = threading.local()
+
+def get_session():
+	if not hasattr(thread_data, 'session'):
+		thread_data.session = requests.Session()
+	return thread_data.session
+
+
+#---------------------------------------------------------------------
+# Method to make an API call, retrying with an exponentially growing
+# delay when it fails for a reason that may pass (see is_retryable()).
+# Any other error is raised straight away.
+#---------------------------------------------------------------------
+def make_API_call_with_retries(state, element):
+	for attempt in range(max_retries+1):
+		try:
+			return make_API_call(state, element)
+		except Exception as e:
+			if (attempt == max_retries or not is_retryable(e)):
+				raise
+			delay = retry_delay * 2**attempt
+			print("Retrying "+element+" API call for "+state+" in "+str(delay)+" seconds after error: "+str(e))
+			time.sleep(delay)
+
+
+#---------------------------------------------------------------------
+# Method to return whether an API call error may pass if the call is made
+# again: connection errors and timeouts (including ones raised while the
+# response streams in), and HTTP 429 (too many requests) or 5xx (server
+# error) responses. Other HTTP errors and errors in this code are not.
+#---------------------------------------------------------------------
+def is_retryable(error):
+	if isinstance(error, requests.HTTPError):
+		status = error.response.status_code if error.response is not None else None
+		return status is not None and (status == 429 or status >= 500)
+	return isinstance(error, (requests.RequestException, urllib3.exceptions.HTTPError, ConnectionError, TimeoutError))
 
 
 #---------------------------------------------------------------------
 # Method definition to make an API call with given State initials, 
 # element desired, and optional date parameters
 #---------------------------------------------------------------------
-def make_API_call(state, element, sdate="1991-01-01", edate="2020-12-31"):
+def make_API_call(state, element, sdate=None, edate=None):
+	sdate = Settings.weather_dates[0] if sdate is None else sdate
+	edate = Settings.weather_dates[1] if edate is None else edate
 	elems = {}  # Serves as a parameter to the API call itself
 	e_name = ''  # Later serves as the column name and part of the filename
 
@@ -73,46 +248,179 @@ def make_API_call(state, element, sdate="1991-01-01", edate="2020-12-31"):
 		elems = {"name":"pcpn","interval":"dly","area_reduce":"county_mean","units":"inch"}
 		e_name = 'AvgPrecip'
 	else:
-		print("\nUnnacceptable element type requested ("+element+"). Please check acceptable elements.")
-		quit()
+		raise Exception("Unnacceptable element type requested ("+element+"). Please check acceptable elements.")
 
 
-	# Make the API call using the requests package and the website's API support
+	# Get the data from the API cache and API calls for any years it is missing
+	# (each attempt is recorded in the metrics file, including failed ones)
 	print("\nAttempting "+e_name+" API call for "+state+" at "+dt.now().strftime("%I:%M%p on %d/%m/%Y"))
-	API_call = requests.post('http://data.rcc-acis.org/GridData', json=
+	with Instrumentation.stage('api_call', state=state, element=element) as metrics:
+		dates, counties, values = get_grid_data(state, elems, sdate, edate, metrics)
+		API_call = pd.DataFrame(values, columns=counties)
+		API_call.insert(0, 'Date', dates)
+
+		# Export the DataFrame to a new CSV
+		API_call.to_csv(weather_file(state, element), index=False, header=True)
+		metrics['rows'] = values.size
+
+		# Check the grid for missing days, counties of interest, and values and write its coverage report
+		# (the gaps are masked or filled by Weather_Store.py whenever the file is loaded)
+		weather = pd.DataFrame(values, index=pd.to_datetime(dates), columns=[int(county) for county in counties])
+		report = Weather_Validation.validate_weather(weather, e_name, counties=get_state_counties()[state],
+													 dates=pd.date_range(start=sdate, end=edate, name='Date'))[1]
+		Weather_Validation.save_coverage_report(report, state, e_name)
+		metrics['missing_cells'] = int(report['Missing Cells'].sum() + report['Sentinel Cells'].sum())
+		metrics['bytes_written'] = Instrumentation.file_size(weather_file(state, element))
+	print("Successful "+e_name+" API call for "+state+" at "+dt.now().strftime("%I:%M%p on %d/%m/%Y"))
+
+
+
+#---------------------------------------------------------------------
+# Method to make one API call for the given dates and decode the response
+# straight into an array holding only the ANSI codes of interest
+#---------------------------------------------------------------------
+def fetch_grid_data(state, elems, sdate, edate, counties_of_interest, metrics):
+	API_call = get_session().post(api_url, timeout=300, stream=True, json=
 		   {"sdate": sdate,
 			"edate": edate,
 			"grid":"21",
 			"elems":[ elems ],
 			"state": state})
+	API_call.raise_for_status()
+	metrics['bytes_read'] += int(API_call.headers.get('Content-Length', 0))
+	num_days = (pd.Timestamp(edate)-pd.Timestamp(sdate)).days + 1
+	return decode_grid_data(API_call, counties_of_interest, num_days)
 
-	# Converts the JSON response to a Python datatype
-	API_call = API_call.json()
-    
-	# Converts the raw Python datatype to a Pandas DataFrame
-	API_call = pd.DataFrame(API_call['data'], columns=['Date', e_name])
 
-	# Separate Dictionaries into new columns 
-	# (turns each ANSI code into its own column with days as rows)
-	# This long function concatenates the Date column with new columns containing the data of each ANSI code
-	API_call = pd.concat([API_call.drop([e_name], axis=1), API_call[e_name].apply(pd.Series)], axis=1)
+#---------------------------------------------------------------------
+# Method to return the dates, ANSI codes, and (day x county) values of a 
+# state and element from sdate to edate, the same as one API call for the
+# whole range would. Years already in the API cache are read from it, the
+# missing ones are downloaded with one API call for each run of missing
+# years, and every complete year downloaded is added to the cache.
+#---------------------------------------------------------------------
+def get_grid_data(state, elems, sdate, edate, metrics):
+	counties_of_interest = list(get_state_counties().get(state, []))
+	if not use_api_cache:
+		metrics['fetched_years'] = pd.Timestamp(edate).year - pd.Timestamp(sdate).year + 1
+		return fetch_grid_data(state, elems, sdate, edate, counties_of_interest, metrics)
 
+	years = range(pd.Timestamp(sdate).year, pd.Timestamp(edate).year+1)
+	segments = {year: read_cache_segment(state, elems, year, counties_of_interest) for year in years}
+	missing = [year for year in years if segments[year] is None]
+	metrics['cached_years'], metrics['fetched_years'] = len(years)-len(missing), len(missing)
 
-	# Delete all ANSI data columns that are not in the areas of interest
-	col_interests = set(areas_of_interest['ANSI Code'].astype(str).str.zfill(5).unique())
-	col_interests.add('Date')
-	for column in list(API_call):  # Removes all county columns that are not of interest
-		if str(column) not in col_interests:
-			API_call.drop(columns=[column], inplace=True)
-	del col_interests
+	# One API call for each run of consecutive missing years
+	for run in np.split(np.array(missing, dtype=int), np.nonzero(np.diff(missing) > 1)[0]+1):
+		if (len(run) == 0):
+			continue
+		start, end = max(sdate, str(run[0])+'-01-01'), min(edate, str(run[-1])+'-12-31')
+		dates, counties, values = fetch_grid_data(state, elems, start, end, counties_of_interest, metrics)
+		fetched = pd.DataFrame(values, index=pd.to_datetime(dates), columns=counties)
+		for year in run:
+			segments[year] = fetched[fetched.index.year == year]
+			write_cache_segment(state, elems, year, counties_of_interest, segments[year])
+	evict_api_cache()
 
-	# Export the DataFrame to a new CSV
-	API_call.to_csv(r''+base_filepath+'/Weather_Data/'+state+'_'+e_name+'.csv', index=False, header=True)
-	print("Successful "+e_name+" API call for "+state+" at "+dt.now().strftime("%I:%M%p on %d/%m/%Y"))
+	# Join the years, keeping the columns in the order of the ANSI codes of interest
+	weather = pd.concat([segments[year] for year in years]).loc[sdate:edate]
+	counties = [county for county in counties_of_interest if county in weather.columns]
+	return weather.index.strftime('%Y-%m-%d').tolist(), counties, weather[counties].to_numpy(dtype=float)
+
+
+#---------------------------------------------------------------------
+# Methods to read and write one year of one state and element's API data
+# in the API cache. Files are named by state, element, area reduction, and
+# year (ex. IN_pcpn_county_mean_2020.npz) and hold the year's values, the
+# ANSI codes found in the response, and the ANSI codes that were asked for.
+# Only complete years are saved, and a year saved for a different set of
+# ANSI codes of interest is treated as missing. Reading a year marks it as
+# recently used for evict_api_cache().
+#---------------------------------------------------------------------
+api_cache_lock = threading.Lock()
+
+def cache_segment_file(state, elems, year):
+	return os.path.expanduser(get_base_filepath()+'/Weather_Data/API_Cache/'+state+'_'+elems['name']+'_'
+							  +elems['area_reduce']+'_'+str(year)+'.npz')
+
+def read_cache_segment(state, elems, year, counties_of_interest):
+	path = cache_segment_file(state, elems, year)
+	try:
+		with np.load(path) as segment:
+			if (segment['requested'].tolist() != counties_of_interest):
+				return None
+			os.utime(path)
+			dates = pd.date_range(str(year)+'-01-01', str(year)+'-12-31')
+			return pd.DataFrame(segment['values'], index=dates, columns=segment['counties'].tolist())
+	except (OSError, ValueError, KeyError):
+		return None  # Not cached (or deleted by another thread while being read)
+
+def write_cache_segment(state, elems, year, counties_of_interest, segment):
+	if (len(segment) != len(pd.date_range(str(year)+'-01-01', str(year)+'-12-31'))):
+		return  # Only complete years are saved
+	path = cache_segment_file(state, elems, year)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	# Written to a temporary file first so an interrupted run never leaves a broken year
+	with open(path+'.tmp', 'wb') as file:
+		np.savez(file, values=segment.to_numpy(dtype=float), counties=np.array(segment.columns, dtype=str),
+				 requested=np.array(counties_of_interest, dtype=str))
+	os.replace(path+'.tmp', path)
+
+
+#---------------------------------------------------------------------
+# Method to delete the least recently used years of the API cache until
+# it is no larger than max_api_cache_mb megabytes
+#---------------------------------------------------------------------
+def evict_api_cache():
+	cache_dir = os.path.expanduser(get_base_filepath()+'/Weather_Data/API_Cache/')
+	with api_cache_lock:
+		if not os.path.isdir(cache_dir):
+			return
+		files = [entry for entry in os.scandir(cache_dir) if entry.name.endswith('.npz')]
+		files.sort(key=lambda entry: entry.stat().st_mtime)
+		total = sum(entry.stat().st_size for entry in files)
+		for entry in files:
+			if (total <= max_api_cache_mb*1024*1024):
+				break
+			total -= entry.stat().st_size
+			os.remove(entry.path)
+
+
+#---------------------------------------------------------------------
+# Method to decode a GridData response ({"data": [[date, {ANSI code: 
+# value, ...}], ...]}) into a list of dates, the ANSI codes of interest
+# found in the response, and a (day x county) array of their values. The
+# array is allocated once and filled a day at a time, and other counties
+# are never copied out of the response. Missing values ('M') become NaN.
+#---------------------------------------------------------------------
+def decode_grid_data(response, counties_of_interest, num_days):
+	if ijson is not None:
+		response.raw.decode_content = True  # Let urllib3 undo any gzip compression while streaming
+		days = ijson.items(response.raw, 'data.item', use_float=True)
+	else:
+		days = iter(response.json()['data'])
+
+	dates, counties, values = [], [], None
+	for i, (date, day_values) in enumerate(days):
+		if values is None:
+			# Lay out the array from the first day, keeping the order of the counties of interest
+			counties = [county for county in counties_of_interest if county in day_values]
+			values = np.full((num_days, len(counties)), np.nan)
+
+		row = [day_values.get(county) for county in counties]
+		try:
+			values[i] = row
+		except (TypeError, ValueError):
+			values[i] = pd.to_numeric(pd.Series(row, dtype=object), errors='coerce').to_numpy(dtype=float)
+		dates.append(date)
 
+	if values is None:
+		values = np.empty((0, 0))
+	return dates, counties, values[:len(dates)]
 
 
 # Run the code in the main method
-main()
+if __name__ == '__main__':
+	main()
 
-print('Weather data has been successfully downloaded and cleaned.')
+	print('Weather data has been successfully downloaded and cleaned.')
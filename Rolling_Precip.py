@@ -0,0 +1,112 @@
+# Code to calculate rolling precipitation totals and their anomalies for every day and county of a state at once
+
+
+# Importing necessary packages
+import numpy as np
+from Season_Index import load_season_index
+from Weather_Store import load_derived
+
+
+# Lengths (in days) of the rolling precipitation totals
+rolling_windows = [30, 60, 90]
+
+# First and last year of the climatology each rolling total is compared against
+climatology_years = [1991, 2020]
+
+# Columns returned by calculate_season_anomalies(): for each window, the mean of the daily anomalies over
+# the season and the lowest one (the largest shortfall in inches against the climatology, when negative)
+rolling_columns = [name+'_'+str(window)+'d' for window in rolling_windows for name in ['Mean_Anomaly', 'Min_Anomaly']]
+
+
+#---------------------------------------------------------------------------
+# Method to return the rolling total of every window length days long ending
+# on each day, for every county at once, as the difference of two rows of
+# the running totals of a season index (see Season_Index.py). Days without
+# a full window before them, and windows containing a missing day, are NaN.
+#---------------------------------------------------------------------------
+def rolling_totals(index, window):
+	precip, missing = index['precip'], index['missing']
+	num_days = precip.shape[0]-1
+	totals = np.full((num_days, precip.shape[1]), np.nan)
+	if (num_days >= window):
+		totals[window-1:] = np.where(missing[window:] - missing[:num_days+1-window] > 0, np.nan,
+									 precip[window:] - precip[:num_days+1-window])
+	return totals
+
+
+#---------------------------------------------------------------------------
+# Method to return each day's rolling totals less the climatology of its
+# calendar day: the mean of the rolling totals ending on the same month and
+# day in every year of climatology_years (per county, ignoring NaN totals).
+# Calendar days with no totals in those years give NaN anomalies.
+#---------------------------------------------------------------------------
+def climatology_anomalies(totals, dates):
+	calendar_days, day_of_row = np.unique(dates.month*100 + dates.day, return_inverse=True)
+	in_climatology = (dates.year >= climatology_years[0]) & (dates.year <= climatology_years[1])
+
+	# Sum and count the totals of each calendar day with one scatter-add each
+	valid = ~np.isnan(totals) & np.asarray(in_climatology)[:, None]
+	sums = np.zeros((len(calendar_days), totals.shape[1]))
+	counts = np.zeros((len(calendar_days), totals.shape[1]))
+	np.add.at(sums, day_of_row, np.where(valid, totals, 0.0))
+	np.add.at(counts, day_of_row, valid)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		climatology = sums/counts
+	return totals - climatology[day_of_row]
+
+
+#---------------------------------------------------------------------------
+# Method to return the rolling anomalies of a state's precipitation (cached
+# with the weather in Weather_Store.py) as a dictionary with the dates and
+# ANSI codes of its rows and columns and one (day x county) array of
+# anomalies for each of rolling_windows. The whole series is covered, so
+# windows reach back before a season starts.
+#---------------------------------------------------------------------------
+def load_rolling_anomalies(state):
+	return load_derived(state, 'AvgPrecip', 'rolling_anomalies', lambda: build_rolling_anomalies(state))
+
+def build_rolling_anomalies(state):
+	index = load_season_index(state, 'AvgPrecip')
+	anomalies = {'dates':index['dates'], 'column_of':index['column_of']}
+	for window in rolling_windows:
+		anomalies[window] = climatology_anomalies(rolling_totals(index, window), index['dates'])
+	return anomalies
+
+
+#---------------------------------------------------------------------------
+# Method to return the rolling anomalies of one growing season as (days x
+# counties) arrays keyed by window (with the columns in the given order,
+# days and counties missing from the state's precipitation get NaN rows
+# and columns)
+#---------------------------------------------------------------------------
+def season_anomalies(anomalies, growth_season, counties):
+	rows = anomalies['dates'].get_indexer(growth_season)
+	columns = np.array([anomalies['column_of'].get(int(county), -1) for county in counties], dtype=int)
+	found_rows, found_columns = rows >= 0, columns >= 0
+	season = {}
+	for window in rolling_windows:
+		season[window] = np.full((len(growth_season), len(counties)), np.nan)
+		season[window][np.ix_(found_rows, found_columns)] = anomalies[window][np.ix_(rows[found_rows],
+																					  columns[found_columns])]
+	return season
+
+
+#---------------------------------------------------------------------------
+# Method to summarize the rolling anomalies of all counties in a single
+# growing season (as returned by season_anomalies()). Returns a dictionary
+# of rolling_columns, each holding one value per county: the mean and the
+# lowest of the daily anomalies over the season, ignoring NaN days (NaN
+# when every day is NaN).
+#---------------------------------------------------------------------------
+def calculate_season_anomalies(season):
+	data = {}
+	for window in rolling_windows:
+		values = season[window]
+		valid = ~np.isnan(values)
+		count = valid.sum(axis=0)
+		with np.errstate(invalid='ignore', divide='ignore'):
+			mean = np.where(valid, values, 0.0).sum(axis=0)/count
+		lowest = np.where(valid, values, np.inf).min(axis=0) if len(values) > 0 else np.full(values.shape[1], np.inf)
+		data['Mean_Anomaly_'+str(window)+'d'] = np.where(count > 0, mean, np.nan).tolist()
+		data['Min_Anomaly_'+str(window)+'d'] = np.where(count > 0, lowest, np.nan).tolist()
+	return data
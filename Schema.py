@@ -0,0 +1,87 @@
+# Data types shared by every file of the toolset so that data is read into compact forms directly
+
+
+# Importing necessary packages
+import os
+import numpy as np
+import pandas as pd
+from Drought_Engine import bucket_names
+
+# Names (repeated on many rows) are stored as categories, ANSI (FIPS) codes as integers, and
+# years and counts as small integers. Columns not listed keep the type pandas gives them.
+name_dtypes = {'State':'category', 'County':'category', 'Ag District':'category',
+			   'Location':'category', 'State Initial':'category', 'State Name':'category'}
+
+# Cleaned yield data written by Read_Data_1.py
+yield_dtypes = dict(name_dtypes, **{'Year':np.int16, 'ANSI Code':np.int32})
+
+# Areas of interest written by Read_Data_1.py
+area_dtypes = dict(name_dtypes, **{'ANSI Code':np.int32})
+
+# Drought data written by Process_Data.py (the County column holds ANSI codes)
+drought_dtypes = {'Year':np.int16, 'County':np.int32, 'State':'category', 'Location':'category',
+				  'Num_Short':np.int16, 'Num_Med':np.int16, 'Num_Long':np.int16,
+				  'Short_Time':np.int16, 'Med_Time':np.int16, 'Long_Time':np.int16, 'Total Drought Time':np.int16}
+
+# Individual droughts written by Process_Data.py
+event_dtypes = {'ANSI Code':np.int32, 'Crop':'category', 'Year':np.int16, 'Length':np.int16,
+				'Bucket':pd.CategoricalDtype(bucket_names)}
+
+# Aggregate cube written by Aggregate_Cube.py
+cube_dtypes = {'Crop':'category', 'State':'category', 'State Name':'category', 'Year':np.int16,
+			   'Metric':'category', 'Count':np.int32}
+
+# County yield regressions written by Yield_Regression.py
+regression_dtypes = {'Crop':'category', 'County':np.int32, 'State':'category', 'Location':'category',
+					 'Year':np.int16, 'Seasons':np.int16}
+
+# Columns holding ANSI codes, which are written to files as zero-padded strings (ex. '01049')
+fips_columns = ['ANSI Code', 'County']
+
+# Daily weather values
+weather_dtype = np.float32
+
+
+#---------------------------------------------------------------------------
+# Method to return a DataFrame with the given types applied to whichever of
+# its columns they list
+#---------------------------------------------------------------------------
+def apply_dtypes(df, dtypes):
+	return df.astype({column:dtypes[column] for column in dtypes if column in df.columns})
+
+
+#---------------------------------------------------------------------------
+# Method to return integer ANSI codes as zero-padded five character strings
+# (a list for a list, or a Series for a Series)
+#---------------------------------------------------------------------------
+def format_fips(codes):
+	if isinstance(codes, pd.Series):
+		return codes.astype(np.int64).map('{:05d}'.format)
+	return ['{:05d}'.format(int(code)) for code in codes]
+
+
+#---------------------------------------------------------------------------
+# Method to write a DataFrame to a CSV file with its ANSI code columns
+# zero-padded (the DataFrame itself keeps its integer codes). With append,
+# the rows are added to the end of the file without a header.
+#---------------------------------------------------------------------------
+def to_csv(df, path, append=False):
+	df = df.assign(**{column:format_fips(df[column]) for column in fips_columns
+					  if column in df.columns and pd.api.types.is_integer_dtype(df[column])})
+	df.to_csv(path, index=False, header=not append, mode='a' if append else 'w')
+
+
+#---------------------------------------------------------------------------
+# Method to check that a data file exists and has the given columns before
+# it is read, raising an error that says which program to run again when it
+# is missing or was written by an older version of the toolset (such as
+# drought data with the old Periods/Lengths columns)
+#---------------------------------------------------------------------------
+def require_columns(path, columns, made_by='Process_Data.py'):
+	path = os.path.expanduser(path)
+	if not os.path.exists(path):
+		raise Exception(path+" does not exist yet. Please run "+made_by+" first.")
+	missing = [column for column in columns if column not in pd.read_csv(path, nrows=0).columns]
+	if (len(missing) > 0):
+		raise Exception(path+" is missing the columns "+", ".join(missing)+" (it was written by an older version "
+						"of the toolset). Please re-run "+made_by+".")
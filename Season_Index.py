@@ -0,0 +1,90 @@
+# Code to answer precipitation and dry-day questions for any window of dates using prefix sums
+
+
+# Importing necessary packages
+import numpy as np
+import pandas as pd
+from Drought_Engine import dry_threshold
+from Weather_Store import load_weather, load_derived
+
+
+#---------------------------------------------------------------------------
+# Method to build the prefix-sum index of a date-indexed weather DataFrame
+# (one column per integer ANSI code). Row i of each array holds the running total of
+# every day before row i of the weather, so the total for any window of days
+# is one subtraction. Missing (NaN) days are counted separately so that a
+# window containing one gives a NaN total, the same as adding up the days.
+#---------------------------------------------------------------------------
+def build_season_index(weather_df):
+	# The weather is stored as 32-bit floats, but every running total is added up in 64-bit floats
+	values = weather_df.to_numpy(dtype=np.float64)
+	missing = np.isnan(values)
+	num_days, num_counties = values.shape
+
+	index = {'dates':pd.DatetimeIndex(weather_df.index), 'columns':[int(column) for column in weather_df.columns]}
+	index['column_of'] = {county:i for i, county in enumerate(index['columns'])}
+	index['precip'] = np.zeros((num_days+1, num_counties), dtype=np.float64)
+	index['dry'] = np.zeros((num_days+1, num_counties), dtype=np.int32)
+	index['missing'] = np.zeros((num_days+1, num_counties), dtype=np.int32)
+	np.cumsum(np.where(missing, 0.0, values), axis=0, dtype=np.float64, out=index['precip'][1:])
+	np.cumsum(values <= dry_threshold, axis=0, out=index['dry'][1:])
+	np.cumsum(missing, axis=0, out=index['missing'][1:])
+
+	# The weather has to cover every day in order for rows to be found by date
+	if (num_days > 0 and len(pd.date_range(index['dates'][0], index['dates'][-1])) != num_days):
+		raise Exception("Weather data must have exactly one row per day to be indexed.")
+	return index
+
+
+#---------------------------------------------------------------------------
+# Method to return the prefix-sum index of a state's weather (cached with
+# the weather in Weather_Store.py)
+#---------------------------------------------------------------------------
+def load_season_index(state, element='AvgPrecip'):
+	return load_derived(state, element, 'season_index', lambda: build_season_index(load_weather(state, element)))
+
+
+#---------------------------------------------------------------------------
+# Method to return the start and end dates of a growing season for each
+# year, where dates holds the start and end month-day (ex. ['-04-01',
+# '-10-31']) and start_offset is the number of years before the harvest
+# year that the season starts (1 for wheat)
+#---------------------------------------------------------------------------
+def season_windows(years, dates, start_offset=0):
+	starts = pd.to_datetime([str(year-start_offset)+dates[0] for year in years])
+	ends = pd.to_datetime([str(year)+dates[1] for year in years])
+	return starts, ends
+
+
+#---------------------------------------------------------------------------
+# Method to return the total precipitation, number of dry days, and number
+# of days of every window from starts to ends (inclusive dates, scalars or
+# arrays of the same length) for the given counties (all counties if None).
+# Each result has one row per window and one column per county, and is
+# found with a constant number of array lookups no matter the window length
+# or the number of days indexed. Totals of windows with missing days are NaN.
+#---------------------------------------------------------------------------
+def season_totals(index, starts, ends, counties=None):
+	starts = pd.DatetimeIndex(np.atleast_1d(pd.to_datetime(starts)))
+	ends = pd.DatetimeIndex(np.atleast_1d(pd.to_datetime(ends)))
+	first = index['dates'].get_indexer(starts)
+	last = index['dates'].get_indexer(ends) + 1
+	if ((first < 0).any() or (last <= 0).any()):
+		raise KeyError("Window dates must be within the indexed weather data.")
+	if (last < first).any():
+		raise ValueError("Window end dates must not be before their start dates.")
+
+	# The window rows are selected before the counties so only those rows are ever copied
+	columns = slice(None) if counties is None else [index['column_of'][int(county)] for county in counties]
+	def window_totals(name):
+		return index[name][last][:, columns] - index[name][first][:, columns]
+
+	totals = {'Total Precipitation':window_totals('precip'), 'Dry Days':window_totals('dry').astype(float)}
+	totals['Num Days'] = np.broadcast_to((last-first)[:, None], totals['Total Precipitation'].shape)
+
+	# Windows containing a missing day give NaN totals, the same as adding up the days
+	has_missing = window_totals('missing') > 0
+	totals['Total Precipitation'][has_missing] = np.nan
+	totals['Dry Days'][has_missing] = np.nan
+	totals['Dry Percentage'] = totals['Dry Days']/totals['Num Days']
+	return totals
@@ -0,0 +1,60 @@
+# Settings shared by every part of the toolset: the data directory every file reads from and writes to,
+# and the days of weather it holds
+
+
+# Editable variables
+
+# The directory holding the Raw_Data and Processed_Data directories. Setting the CROP_YIELD_DATA
+# environment variable (or passing --data-dir to Pipeline.py) uses a different directory.
+data_directory = '~/'
+
+# First and last day of weather downloaded by Read_Data_2.py and expected in the weather files.
+# Extending the range only downloads the years that are not already in its API cache.
+weather_dates = ['1991-01-01', '2020-12-31']
+
+
+# Importing necessary packages
+import os
+
+
+#---------------------------------------------------------------------------
+# Method to return the paths every part of the toolset uses for the given
+# data directory (each directory path ends with a '/')
+#---------------------------------------------------------------------------
+def get_paths(directory):
+	directory = os.path.join(directory, '')
+	return {'data':directory, 'raw':directory+'Raw_Data/', 'processed':directory+'Processed_Data/',
+			'weather':directory+'Processed_Data/Weather_Data/', 'final':directory+'Processed_Data/Final_Data/'}
+
+
+# Paths for the data directory in use (read by the other files whenever they need them)
+data_directory = os.environ.get('CROP_YIELD_DATA', data_directory)
+paths = get_paths(data_directory)
+
+
+# Methods called by set_data_directory() to empty what was loaded from the
+# old directory (each file adds its own with data_directory_changed())
+reset_methods = []
+
+
+#---------------------------------------------------------------------------
+# Decorator for a method that empties data a file has loaded from the data
+# directory, so set_data_directory() calls it whenever the directory changes
+#---------------------------------------------------------------------------
+def data_directory_changed(method):
+	reset_methods.append(method)
+	return method
+
+
+#---------------------------------------------------------------------------
+# Method to use a different data directory. The other files read their
+# paths from this file whenever they need them (unless a path is set in the
+# file itself), and everything already loaded from the old directory is
+# emptied so it is read again from the new one.
+#---------------------------------------------------------------------------
+def set_data_directory(directory):
+	global data_directory
+	data_directory = directory
+	paths.update(get_paths(directory))
+	for method in reset_methods:
+		method()
@@ -0,0 +1,279 @@
+# Code to load the downloaded weather data and share it between counties and crops
+
+
+# Editable variables
+
+# The directory holding the weather files written by Read_Data_2.py (None uses the
+# Weather_Data directory of the data directory set in Settings.py)
+weather_filepath = None
+
+# Whether to read weather from the binary store (see convert_weather_csvs()) when one exists for an element
+use_binary_store = True
+
+# Maximum memory (in megabytes) that loaded weather DataFrames may use before
+# the least recently used ones are removed from the cache
+cache_limit_mb = 2048
+
+
+# Importing necessary packages
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+import Settings
+import Schema
+import Weather_Validation
+
+
+# Cache of loaded weather DataFrames keyed by (state, element), and of values derived from them keyed
+# by (state, element, name), ordered from least to most recently used
+weather_cache = OrderedDict()
+cache_stats = {'hits':0, 'misses':0, 'evictions':0, 'bytes':0}
+
+# Opened binary stores keyed by element
+weather_stores = {}
+
+
+#---------------------------------------------------------------------------
+# Method to return the weather DataFrame (date-indexed, one float32 column
+# per integer ANSI code) for a state and element. The file is only read and parsed the first
+# time it is requested, every later request gets the same DataFrame back.
+# Element names match the file names written by Read_Data_2.py ('AvgPrecip',
+# 'AvgTemp', 'MaxTemp', or 'MinTemp').
+#---------------------------------------------------------------------------
+def load_weather(state, element='AvgPrecip'):
+	key = (state, element)
+	if key in weather_cache:
+		cache_stats['hits'] += 1
+		weather_cache.move_to_end(key)
+		return weather_cache[key][0]
+
+	cache_stats['misses'] += 1
+	if (use_binary_store and state_in_store(state, element)):
+		weather = load_binary_weather(state, element)
+		size = int(weather.index.memory_usage())  # The values themselves stay in the memory-mapped file
+		if (Weather_Validation.missing_policy == 'interpolate'):
+			# The store only has its gaps masked, so filling them needs a copy of the state's values
+			weather = Weather_Validation.validate_weather(weather, element, dates=expected_dates(weather))[0]
+			size = int(weather.memory_usage(index=True).sum())
+	else:
+		# Reads in the weather data set as float32 values and fills in or masks its gaps (see Weather_Validation.py)
+		weather = read_weather_csv(get_weather_filepath()+state+'_'+element+'.csv')
+		weather = Weather_Validation.validate_weather(weather, element, dates=expected_dates(weather))[0]
+		size = int(weather.memory_usage(index=True).sum())
+
+	weather_cache[key] = (weather, size)
+	cache_stats['bytes'] += size
+	evict_weather(cache_limit_mb*1024*1024)
+	return weather
+
+
+#---------------------------------------------------------------------------
+# Method to return every day weather is expected for: the days downloaded
+# by Read_Data_2.py (Settings.weather_dates), along with any days of the given
+# weather outside them. Days missing from a file become NaN rows when it
+# is validated, so missing_policy applies to them the same as to a gap.
+#---------------------------------------------------------------------------
+def expected_dates(weather):
+	start, end = pd.Timestamp(Settings.weather_dates[0]), pd.Timestamp(Settings.weather_dates[1])
+	if (len(weather.index) > 0):
+		start, end = min(start, weather.index.min()), max(end, weather.index.max())
+	return pd.date_range(start=start, end=end, name='Date')
+
+
+#---------------------------------------------------------------------------
+# Method to return a value derived from a state's weather for an element
+# (a dictionary of arrays, such as the running totals of Season_Index.py),
+# calling build() to make it the first time it is requested. Derived values
+# share the weather cache and its cache_limit_mb, so they are evicted and
+# cleared along with the weather (they are not counted as weather hits or
+# misses).
+#---------------------------------------------------------------------------
+def load_derived(state, element, name, build):
+	key = (state, element, name)
+	if key in weather_cache:
+		weather_cache.move_to_end(key)
+		return weather_cache[key][0]
+
+	value = build()
+	size = sum(int(array.nbytes) for array in value.values() if isinstance(array, np.ndarray))
+	weather_cache[key] = (value, size)
+	cache_stats['bytes'] += size
+	evict_weather(cache_limit_mb*1024*1024)
+	return value
+
+
+#---------------------------------------------------------------------------
+# Method to read a weather CSV file written by Read_Data_2.py as a date-
+# indexed DataFrame of float32 values with one column per integer ANSI code
+# (missing 'M' values become NaN)
+#---------------------------------------------------------------------------
+def read_weather_csv(path):
+	columns = [column for column in pd.read_csv(path, nrows=0).columns if column != 'Date']
+	weather = pd.read_csv(path, dtype={column:Schema.weather_dtype for column in columns}, na_values=['M'])
+	weather['Date'] = pd.to_datetime(weather['Date'])
+	weather.set_index('Date', inplace=True)
+	weather.columns = weather.columns.astype(np.int32)
+	return weather
+
+
+#---------------------------------------------------------------------------
+# Method to remove the least recently used entries from the cache until it
+# fits in limit_bytes. The most recently loaded entry is always kept so a
+# single oversized state can still be used.
+#---------------------------------------------------------------------------
+def evict_weather(limit_bytes):
+	while (cache_stats['bytes'] > limit_bytes and len(weather_cache) > 1):
+		key, (value, size) = weather_cache.popitem(last=False)
+		cache_stats['bytes'] -= size
+		cache_stats['evictions'] += 1
+
+
+#---------------------------------------------------------------------------
+# Method to empty the weather cache, including every value derived from the
+# weather (for example after new data is downloaded or the data directory
+# changes)
+#---------------------------------------------------------------------------
+@Settings.data_directory_changed
+def clear_weather_cache():
+	weather_cache.clear()
+	weather_stores.clear()
+	cache_stats['bytes'] = 0
+
+
+#---------------------------------------------------------------------------
+# Method to return the directory of the weather files (weather_filepath, or
+# the Weather_Data directory set in Settings.py)
+#---------------------------------------------------------------------------
+def get_weather_filepath():
+	return Settings.paths['weather'] if weather_filepath is None else weather_filepath
+
+
+#---------------------------------------------------------------------------
+# Method to return the path of an element's binary store file with the given
+# extension ('.f32' for the data, '.json' for the sidecar index)
+#---------------------------------------------------------------------------
+def store_path(element, extension):
+	return os.path.expanduser(get_weather_filepath()+element+extension)
+
+
+#---------------------------------------------------------------------------
+# Method to return whether an element's binary store exists and holds the
+# given state (states missing from it are read from their CSV files instead)
+#---------------------------------------------------------------------------
+def state_in_store(state, element):
+	if not os.path.exists(store_path(element, '.json')):
+		return False
+	return state in open_weather_store(element)['states']
+
+
+#---------------------------------------------------------------------------
+# Method to delete an element's binary store so its CSV files are read
+# instead (called whenever one of them is rewritten, until the store is
+# converted again)
+#---------------------------------------------------------------------------
+def remove_weather_store(element):
+	weather_stores.pop(element, None)
+	for extension in ['.json', '.f32']:
+		if os.path.exists(store_path(element, extension)):
+			os.remove(store_path(element, extension))
+	for key in [key for key in weather_cache if key[1] == element]:
+		cache_stats['bytes'] -= weather_cache.pop(key)[1]
+
+
+#---------------------------------------------------------------------------
+# Method to open an element's binary store. The data is one contiguous 
+# float32 array of shape (day x county) that is memory-mapped rather than
+# read, so slicing out a county or a season does not copy anything and 
+# separate processes can share the same pages. Returns a dictionary with the
+# array, the DatetimeIndex of its rows, the integer ANSI code of each column, and the
+# [first, last) column range of each state.
+#---------------------------------------------------------------------------
+def open_weather_store(element):
+	if element not in weather_stores:
+		with open(store_path(element, '.json')) as index_file:
+			index = json.load(index_file)
+		dates = pd.date_range(start=index['start'], periods=index['num_days'], name='Date')
+		grid = np.memmap(store_path(element, '.f32'), dtype=np.float32, mode='r', 
+						 shape=(index['num_days'], len(index['columns'])))
+		columns = pd.Index(index['columns']).astype(np.int32)
+		weather_stores[element] = {'grid':grid, 'dates':dates, 'columns':columns, 
+								   'column_of':{ansi:i for i, ansi in enumerate(columns.tolist())},
+								   'states':index['states']}
+	return weather_stores[element]
+
+
+#---------------------------------------------------------------------------
+# Method to return a state's weather as a date-indexed DataFrame backed 
+# directly by the memory-mapped binary store (no copy is made)
+#---------------------------------------------------------------------------
+def load_binary_weather(state, element='AvgPrecip'):
+	store = open_weather_store(element)
+	first, last = store['states'][state]
+	return pd.DataFrame(store['grid'][:, first:last], index=store['dates'], 
+						columns=store['columns'][first:last], copy=False)
+
+
+#---------------------------------------------------------------------------
+# Method to return one county's weather between two dates (inclusive) as a
+# zero-copy view into the binary store
+#---------------------------------------------------------------------------
+def read_county_season(county, start, end, element='AvgPrecip'):
+	store = open_weather_store(element)
+	first = store['dates'].get_loc(pd.Timestamp(start))
+	last = store['dates'].get_loc(pd.Timestamp(end))
+	return store['grid'][first:last+1, store['column_of'][int(county)]]
+
+
+#---------------------------------------------------------------------------
+# One-time converter from the per-state CSV files written by Read_Data_2.py
+# to the binary store for an element. Each state's counties are given a
+# contiguous block of columns so a state can be sliced out without copying.
+#---------------------------------------------------------------------------
+def convert_weather_csvs(element='AvgPrecip'):
+	suffix = '_'+element+'.csv'
+	paths = sorted(glob.glob(os.path.expanduser(get_weather_filepath())+'*'+suffix))
+	if (len(paths) == 0):
+		raise Exception("No weather files found for element '"+element+"' in "+get_weather_filepath())
+
+	# First pass only reads the headers and dates to lay out the array
+	state_columns, start, end = {}, None, None
+	for path in paths:
+		state = os.path.basename(path)[:-len(suffix)]
+		dates = pd.to_datetime(pd.read_csv(path, usecols=['Date'])['Date'])
+		state_columns[state] = [column for column in pd.read_csv(path, nrows=0).columns if column != 'Date']
+		start = dates.min() if start is None else min(start, dates.min())
+		end = dates.max() if end is None else max(end, dates.max())
+	all_dates = pd.date_range(start=start, end=end, name='Date')
+
+	columns, states = [], {}
+	for state in state_columns:
+		states[state] = [len(columns), len(columns)+len(state_columns[state])]
+		columns += state_columns[state]
+
+	# Second pass copies each state's values into its block of the array. Days missing from a file, sentinel
+	# values, and out of range values are stored as NaN (missing_policy is applied when the store is loaded).
+	grid = np.memmap(store_path(element, '.f32'), dtype=np.float32, mode='w+', shape=(len(all_dates), len(columns)))
+	for path, state in zip(paths, state_columns):
+		weather = Weather_Validation.validate_weather(read_weather_csv(path), element, dates=all_dates, policy='mask')[0]
+		first, last = states[state]
+		grid[:, first:last] = weather.to_numpy(dtype=np.float32)
+	grid.flush()
+	del grid
+
+	with open(store_path(element, '.json'), 'w') as index_file:
+		json.dump({'element':element, 'start':str(all_dates[0].date()), 'num_days':len(all_dates),
+				   'columns':columns, 'states':states}, index_file)
+	weather_stores.pop(element, None)
+	print("Converted "+str(len(paths))+" "+element+" files into "+store_path(element, '.f32'))
+
+
+#---------------------------------------------------------------------------
+# Converts every element that has downloaded CSV files when run directly
+#---------------------------------------------------------------------------
+if __name__ == '__main__':
+	for element in ['MaxTemp', 'MinTemp', 'AvgTemp', 'AvgPrecip']:
+		if (len(glob.glob(os.path.expanduser(get_weather_filepath())+'*_'+element+'.csv')) > 0):
+			convert_weather_csvs(element)
@@ -0,0 +1,163 @@
+# Code to check a state's weather grid for missing dates, counties, and values and to apply a policy to the gaps
+#
+# Usage: python Weather_Validation.py writes the coverage report of every downloaded weather file
+
+
+# Editable variables
+
+# The directory the coverage reports are written to, one file per state and element (None uses
+# Weather_Data/Coverage in the data directory set in Settings.py)
+coverage_filepath = None
+
+# What is done with missing and invalid values once they are found:
+#   'mask':        they are left as NaN (a missing day breaks a drought without ending it and
+#                  gives an empty season total, the same as a missing 'M' value)
+#   'interpolate': gaps of up to max_interpolate_days days between two valid days are filled
+#                  in a straight line between them, longer gaps are left as NaN
+#   'skip':        they are left as NaN and Process_Data.py leaves out every county-year whose
+#                  growing season has any missing precipitation
+missing_policy = 'mask'
+
+# Longest gap (in days) filled when missing_policy is 'interpolate'
+max_interpolate_days = 3
+
+# Values ACIS and other sources use in place of a missing value
+sentinel_values = [-999, -9999, -99999]
+
+# Lowest and highest plausible value of each element, values outside them are treated as missing
+valid_ranges = {'AvgPrecip':(0, 50), 'AvgTemp':(-80, 140), 'MaxTemp':(-80, 140), 'MinTemp':(-80, 140)}
+
+
+# Importing necessary packages
+import glob
+import os
+import sys
+import numpy as np
+import pandas as pd
+import Settings
+from Drought_Engine import find_runs
+import Schema
+
+
+# Columns of the coverage reports
+coverage_columns = ['State', 'Element', 'County', 'Days', 'Missing Dates', 'Missing Column', 'Sentinel Cells',
+					'Missing Cells', 'Filled Cells', 'Coverage']
+
+
+#---------------------------------------------------------------------------
+# Method to validate a state's weather for one element (a date-indexed
+# DataFrame with one column per integer ANSI code) with whole-array
+# operations. The DataFrame is first laid out over every day of dates
+# (from its first to its last day when None) and every ANSI code of
+# counties (its own columns when None), so missing dates and counties
+# become NaN rows and columns. Sentinel values and values outside the
+# element's valid range are then set to NaN, and policy (missing_policy
+# when None) is applied. Returns the validated DataFrame (in the same
+# dtype) and a coverage report with one row per county:
+#   Days: number of days expected
+#   Missing Dates: days missing from the index
+#   Missing Column: whether the county was missing from the columns
+#   Sentinel Cells: sentinel or out of range values
+#   Missing Cells: NaN values (including the missing dates and columns)
+#   Filled Cells: values filled by interpolation
+#   Coverage: fraction of the days with a value after the policy is applied
+#---------------------------------------------------------------------------
+def validate_weather(weather, element, counties=None, dates=None, policy=None):
+	policy = missing_policy if policy is None else policy
+	if policy not in ['mask', 'interpolate', 'skip']:
+		raise ValueError("Unknown missing_policy '"+str(policy)+"', please use 'mask', 'interpolate', or 'skip'.")
+	dtype = np.result_type(*weather.dtypes) if len(weather.columns) > 0 else Schema.weather_dtype
+
+	# Lay out the expected days and counties
+	weather = weather[~weather.index.duplicated()]
+	if dates is None:
+		dates = pd.date_range(start=weather.index.min(), end=weather.index.max(), name='Date')
+	counties = list(weather.columns) if counties is None else [int(county) for county in counties]
+	missing_dates = ~dates.isin(weather.index)
+	missing_columns = ~np.isin(counties, weather.columns)
+	values = weather.reindex(index=dates, columns=counties).to_numpy(dtype=float, copy=True)
+
+	# Flag every missing and invalid cell at once
+	low, high = valid_ranges.get(element, (-np.inf, np.inf))
+	missing = np.isnan(values)
+	with np.errstate(invalid='ignore'):
+		sentinel = np.isin(values, sentinel_values) | (values < low) | (values > high)
+	values[sentinel] = np.nan
+
+	filled = np.zeros(values.shape, dtype=bool)
+	if (policy == 'interpolate'):
+		filled = interpolate_gaps(values)
+
+	report = pd.DataFrame({'County':counties, 'Days':len(dates), 'Missing Dates':int(missing_dates.sum()),
+						   'Missing Column':missing_columns, 'Sentinel Cells':sentinel.sum(axis=0),
+						   'Missing Cells':missing.sum(axis=0), 'Filled Cells':filled.sum(axis=0)})
+	with np.errstate(invalid='ignore', divide='ignore'):
+		report['Coverage'] = (~np.isnan(values)).sum(axis=0)/len(dates)
+	return pd.DataFrame(values.astype(dtype), index=dates, columns=counties), report
+
+
+#---------------------------------------------------------------------------
+# Method to fill every gap (run of NaN days) of at most max_interpolate_days
+# days that has a valid day on both sides in place, on a straight line
+# between those two days. All gaps of all counties are filled at once.
+# Returns a mask of the filled cells.
+#---------------------------------------------------------------------------
+def interpolate_gaps(values):
+	county, start, length = find_runs(np.isnan(values))
+	keep = (length <= max_interpolate_days) & (start > 0) & (start+length < values.shape[0])
+	county, start, length = county[keep], start[keep], length[keep]
+
+	# The row of every cell in the gaps, with the gap's valid days before and after it
+	offset = np.arange(length.sum()) - np.repeat(np.cumsum(length)-length, length) + 1
+	before, cols = np.repeat(start-1, length), np.repeat(county, length)
+	after = np.repeat(start+length, length)
+	rows = before + offset
+	values[rows, cols] = values[before, cols] + (values[after, cols]-values[before, cols])*offset/(after-before)
+
+	filled = np.zeros(values.shape, dtype=bool)
+	filled[rows, cols] = True
+	return filled
+
+
+#---------------------------------------------------------------------------
+# Method to return the directory of the coverage reports (coverage_filepath,
+# or Weather_Data/Coverage in the data directory set in Settings.py)
+#---------------------------------------------------------------------------
+def get_coverage_filepath():
+	return Settings.paths['weather']+'Coverage/' if coverage_filepath is None else coverage_filepath
+
+
+#---------------------------------------------------------------------------
+# Methods to write a state and element's coverage report (as returned by
+# validate_weather()) and to read every report written into one DataFrame
+#---------------------------------------------------------------------------
+def save_coverage_report(report, state, element):
+	os.makedirs(os.path.expanduser(get_coverage_filepath()), exist_ok=True)
+	report = report.assign(State=state, Element=element)[coverage_columns]
+	Schema.to_csv(report, os.path.expanduser(get_coverage_filepath()+state+'_'+element+'.csv'))
+
+def load_coverage_report():
+	paths = sorted(glob.glob(os.path.expanduser(get_coverage_filepath())+'*.csv'))
+	if (len(paths) == 0):
+		return pd.DataFrame(columns=coverage_columns)
+	return pd.concat([pd.read_csv(path, dtype={'State':str, 'Element':str, 'County':np.int32}) for path in paths],
+					 ignore_index=True)
+
+
+# Write the coverage report of every downloaded weather file (against the counties of interest) and
+# print the counties missing the most days (usage: python Weather_Validation.py [coverage threshold])
+if __name__ == '__main__':
+	import Weather_Store
+	areas = pd.read_csv(Settings.paths['processed']+'Areas_of_Interest.csv', dtype=Schema.area_dtypes)
+	state_counties = areas.groupby('State Initial', observed=True)['ANSI Code'].unique().to_dict()
+	for path in sorted(glob.glob(os.path.expanduser(Weather_Store.get_weather_filepath())+'*_*.csv')):
+		state, element = os.path.basename(path)[:-len('.csv')].split('_', 1)
+		if element in valid_ranges:
+			weather = Weather_Store.read_weather_csv(path)
+			save_coverage_report(validate_weather(weather, element, state_counties.get(state))[1], state, element)
+
+	threshold = float(sys.argv[1]) if len(sys.argv) > 1 else 0.99
+	report = load_coverage_report()
+	print(str(len(report))+" county files checked, "+str(int((report['Coverage'] < threshold).sum()))+
+		  " have less than "+str(threshold)+" coverage")
+	print(report[report['Coverage'] < threshold].sort_values('Coverage').head(20).to_string(index=False))
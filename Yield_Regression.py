@@ -0,0 +1,184 @@
+# Code to fit a detrended yield regression for every county and crop at once from the final drought data
+
+
+# Editable variables
+# The Processed_Data directory (None uses the one in the data directory set in Settings.py)
+base_filepath = None
+
+# Columns of the final drought data used to explain each county's yield anomalies (columns
+# with no data for a crop, like the heat columns before maxt and mint are downloaded, are skipped)
+regression_predictors = ['Total Drought Time', 'Total Precipitation', 'KDD']
+
+# Minimum number of seasons with a yield and every predictor a county needs to be fitted
+min_seasons = 10
+
+
+# Importing necessary packages
+import os
+import numpy as np
+import pandas as pd
+import Settings
+import Instrumentation
+import Schema
+
+
+#---------------------------------------------------------------------------
+# Method to return the directory this file reads from and writes to
+# (base_filepath, or the Processed_Data directory set in Settings.py)
+#---------------------------------------------------------------------------
+def get_base_filepath():
+	return Settings.paths['processed'] if base_filepath is None else base_filepath
+
+
+#---------------------------------------------------------------------------
+# Method to return the least squares coefficients of a stack of regressions
+# at once. design holds one (seasons x terms) matrix per county and target
+# one value per county and season, with the rows of unused seasons set to 0
+# so they add nothing to the sums. The normal equations of every county are
+# solved together with a pseudo-inverse, so a term that never changes in a
+# county (like a county that was never in drought) gets a coefficient of 0
+# instead of stopping the fit.
+#---------------------------------------------------------------------------
+def batched_least_squares(design, target):
+	gram = np.einsum('cst,csu->ctu', design, design)
+	moments = np.einsum('cst,cs->ct', design, target)
+	return np.einsum('ctu,cu->ct', np.linalg.pinv(gram), moments)
+
+
+#---------------------------------------------------------------------------
+# Method to center a (county x season x column) array on each county's mean
+# over the seasons it uses, returning the centered array (0 for the seasons
+# that are not used) and the means
+#---------------------------------------------------------------------------
+def center_columns(columns, used):
+	columns = np.where(used[..., None], columns, 0.0)
+	means = columns.sum(axis=1)/np.maximum(used.sum(axis=1), 1)[:, None]
+	return np.where(used[..., None], columns - means[:, None, :], 0.0), means
+
+
+#---------------------------------------------------------------------------
+# Method to fit the regression of every county of one crop at once. Each
+# county's yields are detrended with a straight line over the years, and
+# the yield anomalies (the yield less the county's mean and trend) are
+# explained by the predictors together with the trend:
+#   Yield = Mean Yield + Trend*(Year - mean year) + sum(Coef*(predictor - its mean))
+# df holds one row per county and season with the County, State, Location,
+# Year, Yield Value, and predictor columns. Returns one row per county and
+# season holding the yield anomaly, the anomaly fitted by the predictors,
+# and the residual, along with the county's number of seasons, mean yield,
+# trend (bu/A per year), predictor coefficients, and R2 (the fraction of the
+# variance of the yield anomalies explained by the predictors).
+#---------------------------------------------------------------------------
+def fit_county_regressions(df, predictors):
+	# Lay out every column as a (county x year) array, so all counties are fitted together
+	layout = df.set_index(['County', 'Year'])[['Yield Value']+predictors].unstack('Year')
+	counties, years = layout.index, layout['Yield Value'].columns
+	yields = layout['Yield Value'].to_numpy(dtype=float)
+	values = np.stack([layout[predictor].to_numpy(dtype=float) for predictor in predictors], axis=2)
+
+	# Seasons missing the yield or any predictor are left out of their county's fit, and counties
+	# with too few seasons left (at least one more than the number of terms) are not fitted
+	used = ~np.isnan(yields) & ~np.isnan(values).any(axis=2)
+	num_seasons = used.sum(axis=1)
+	fitted = num_seasons >= max(min_seasons, len(predictors)+3)
+	used &= fitted[:, None]
+
+	# Center every column on its county's mean over the seasons used
+	yields_c, mean_yield = center_columns(yields[..., None], used)
+	trend_c = center_columns(np.broadcast_to(years.to_numpy(dtype=float), yields.shape)[..., None], used)[0]
+	values_c = center_columns(values, used)[0]
+	yields_c, mean_yield = yields_c[..., 0], mean_yield[:, 0]
+
+	# Detrend the yields, then fit the trend and predictors together
+	anomaly = yields_c - trend_c[..., 0]*batched_least_squares(trend_c, yields_c)
+	design = np.concatenate([trend_c, values_c], axis=2)
+	coefficients = batched_least_squares(design, yields_c)
+	residual = yields_c - np.einsum('cst,ct->cs', design, coefficients)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		r2 = 1 - (residual**2).sum(axis=1)/(anomaly**2).sum(axis=1)
+
+	# One row per county and season (counties that could not be fitted get NaN values)
+	per_county = pd.DataFrame({'County':counties, 'Seasons':np.where(fitted, num_seasons, 0),
+							   'Mean Yield':np.where(fitted, mean_yield, np.nan),
+							   'Trend':np.where(fitted, coefficients[:, 0], np.nan)})
+	for i, predictor in enumerate(predictors):
+		per_county[predictor+' Coef'] = np.where(fitted, coefficients[:, i+1], np.nan)
+	per_county['R2'] = np.where(fitted, r2, np.nan)
+
+	per_season = pd.DataFrame({'County':np.repeat(counties, len(years)), 'Year':np.tile(years, len(counties)),
+							   'Yield Anomaly':np.where(used, anomaly, np.nan).ravel(),
+							   'Fitted Anomaly':np.where(used, anomaly - residual, np.nan).ravel(),
+							   'Residual':np.where(used, residual, np.nan).ravel()})
+	table = df[['County', 'State', 'Location', 'Year', 'Yield Value']].merge(per_season, how='left', on=['County', 'Year'])
+	return table.merge(per_county, how='left', on='County')
+
+
+#---------------------------------------------------------------------------
+# Method to build the regression table of every crop (a dictionary of crop
+# name to final drought data, which holds the drought columns) from the
+# drought columns and the cleaned yields of each crop (a dictionary of crop
+# name to cleaned yield data). Predictors with no data for a crop are left
+# out of its fit (as are ones missing from older drought files) and their
+# coefficients are left empty.
+#---------------------------------------------------------------------------
+def build_yield_regression(crop_data, crop_yields):
+	tables = []
+	for crop in crop_data:
+		yields = crop_yields[crop][['Year', 'ANSI Code', 'Value']].rename(columns={'ANSI Code':'County', 'Value':'Yield Value'})
+		df = crop_data[crop].drop(columns=['Yield Value'], errors='ignore').merge(yields, how='inner', on=['Year', 'County'])
+		predictors = [predictor for predictor in regression_predictors if predictor in df and df[predictor].notna().any()]
+		table = fit_county_regressions(df, predictors)
+		table.insert(0, 'Crop', crop)
+		tables.append(table)
+
+	columns = list(tables[0].columns[:-1])
+	columns = [column for column in columns if not column.endswith(' Coef')] + \
+			  [predictor+' Coef' for predictor in regression_predictors] + ['R2']
+	return Schema.apply_dtypes(pd.concat(tables, ignore_index=True).reindex(columns=columns), Schema.regression_dtypes)
+
+
+#---------------------------------------------------------------------------
+# Method to return the regression table saved in Final_Data, building and
+# saving it first if it does not exist yet or if any crop's drought data or
+# cleaned yields are newer than it
+#---------------------------------------------------------------------------
+def load_yield_regression(crop_list=['Corn', 'Soybean', 'Wheat']):
+	regression_file = os.path.expanduser(get_base_filepath()+'Final_Data/Yield_Regression.csv')
+	crop_files = {crop: os.path.expanduser(get_base_filepath()+'Final_Data/'+crop+'_Droughts.csv') for crop in crop_list}
+	yield_files = {crop: os.path.expanduser(get_base_filepath()+'Cleaned_'+crop+'_Yield.csv') for crop in crop_list}
+	columns = ['Year', 'County', 'State', 'Location']+regression_predictors
+	for crop in crop_list:
+		Schema.require_columns(crop_files[crop], columns)
+		Schema.require_columns(yield_files[crop], ['Year', 'ANSI Code', 'Value'], made_by='Read_Data_1.py')
+	if (os.path.exists(regression_file) and
+			all(os.path.getmtime(path) <= os.path.getmtime(regression_file)
+				for path in list(crop_files.values())+list(yield_files.values()))):
+		return pd.read_csv(regression_file, dtype=Schema.regression_dtypes, float_precision='round_trip')
+
+	with Instrumentation.stage('build_yield_regression') as metrics:
+		crop_data = {crop: pd.read_csv(crop_files[crop], usecols=lambda column: column in columns,
+									   dtype=Schema.drought_dtypes) for crop in crop_list}
+		crop_yields = {crop: pd.read_csv(yield_files[crop], usecols=['Year', 'ANSI Code', 'Value'],
+										 dtype=Schema.yield_dtypes) for crop in crop_list}
+		regression = build_yield_regression(crop_data, crop_yields)
+		Schema.to_csv(regression, regression_file)
+		metrics['rows'] = sum(len(df) for df in crop_data.values())
+		metrics['bytes_read'] = sum(Instrumentation.file_size(path)
+									for path in list(crop_files.values())+list(yield_files.values()))
+		metrics['bytes_written'] = Instrumentation.file_size(regression_file)
+	return regression
+
+
+#---------------------------------------------------------------------------
+# Method to return the median number of seasons, trend, coefficients, and R2
+# of the fitted counties of each crop (one column per crop)
+#---------------------------------------------------------------------------
+def summarize_yield_regression(regression):
+	per_county = regression.drop_duplicates(['Crop', 'County']).dropna(subset=['R2'])
+	columns = ['Seasons', 'Trend']+[predictor+' Coef' for predictor in regression_predictors]+['R2']
+	return per_county.groupby('Crop', observed=True)[columns].median().T
+
+
+# Build (or read) the regression table and print a summary of each crop's counties
+if __name__ == '__main__':
+	print(summarize_yield_regression(load_yield_regression()).to_string())